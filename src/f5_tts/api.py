@@ -9,6 +9,7 @@ from cached_path import cached_path
 from f5_tts.infer.utils_infer import (
     hop_length,
     infer_process,
+    infer_process_stream,
     load_model,
     load_vocoder,
     preprocess_ref_audio_text,
@@ -17,6 +18,7 @@ from f5_tts.infer.utils_infer import (
     transcribe,
     target_sample_rate,
 )
+from f5_tts.infer.voices import VoiceRegistry
 from f5_tts.model import DiT, UNetT
 from f5_tts.model.utils import seed_everything
 
@@ -27,12 +29,13 @@ class F5TTS:
         model_type="F5-TTS",
         ckpt_file="",
         vocab_file="",
-        ode_method="euler",
+        ode_method="euler",  # euler | midpoint | heun | dpm++2m | unipc
         use_ema=True,
         vocoder_name="vocos",
         local_path=None,
         device=None,
         hf_cache_dir=None,
+        voices_dir=None,  # registry of preprocessed reference voices, see add_voice()
     ):
         # Initialize parameters
         self.final_wave = None
@@ -55,6 +58,8 @@ class F5TTS:
             model_type, ckpt_file, vocoder_name, vocab_file, ode_method, use_ema, hf_cache_dir=hf_cache_dir
         )
 
+        self.voices = VoiceRegistry(voices_dir, mel_spec_type=vocoder_name) if voices_dir is not None else None
+
     def load_vocoder_model(self, vocoder_name, local_path=None, hf_cache_dir=None):
         self.vocoder = load_vocoder(vocoder_name, local_path is not None, local_path, self.device, hf_cache_dir)
 
@@ -85,6 +90,20 @@ class F5TTS:
             model_cls, model_cfg, ckpt_file, mel_spec_type, vocab_file, ode_method, use_ema, self.device
         )
 
+    def add_voice(self, name, ref_file, ref_text=""):
+        # preprocess reference once and save it, later infer with voice=name
+        assert self.voices is not None, "voices_dir not set"
+        return self.voices.add(name, ref_file, ref_text, device=self.device)
+
+    def load_ref(self, ref_file, ref_text, voice=None):
+        # voice: name in voices_dir or a VoiceProfile, preprocessed already, ref_file & ref_text unused then
+        if voice is None:
+            return preprocess_ref_audio_text(ref_file, ref_text, device=self.device)
+        if isinstance(voice, str):
+            assert self.voices is not None, "voices_dir not set"
+            voice = self.voices.get(voice)
+        return voice, voice.ref_text
+
     def transcribe(self, ref_audio, language=None):
         return transcribe(ref_audio, language)
 
@@ -106,22 +125,30 @@ class F5TTS:
         progress=tqdm,
         target_rms=0.1,
         cross_fade_duration=0.15,
+        cross_fade_curve="linear",  # linear | equal_power
         sway_sampling_coef=-1,
         cfg_strength=2,
+        cfg_interval=None,
+        cfg_decay=None,
+        cfg_null_interval=1,
         nfe_step=32,
+        deep_cache_interval=1,
         speed=1.0,
         fix_duration=None,
+        batch_chunks=False,
         remove_silence=False,
         file_wave=None,
         file_spect=None,
         seed=-1,
+        voice=None,
+        cancel_token=None,  # CancellationToken to cancel from another thread or set a deadline
     ):
         if seed == -1:
             seed = random.randint(0, sys.maxsize)
         seed_everything(seed)
         self.seed = seed
 
-        ref_file, ref_text = preprocess_ref_audio_text(ref_file, ref_text, device=self.device)
+        ref_file, ref_text = self.load_ref(ref_file, ref_text, voice)
 
         wav, sr, spect = infer_process(
             ref_file,
@@ -134,12 +161,19 @@ class F5TTS:
             progress=progress,
             target_rms=target_rms,
             cross_fade_duration=cross_fade_duration,
+            cross_fade_curve=cross_fade_curve,
             nfe_step=nfe_step,
             cfg_strength=cfg_strength,
+            cfg_interval=cfg_interval,
+            cfg_decay=cfg_decay,
+            cfg_null_interval=cfg_null_interval,
             sway_sampling_coef=sway_sampling_coef,
+            deep_cache_interval=deep_cache_interval,
             speed=speed,
             fix_duration=fix_duration,
+            batch_chunks=batch_chunks,
             device=self.device,
+            cancel_token=cancel_token,
         )
 
         if file_wave is not None:
@@ -150,6 +184,64 @@ class F5TTS:
 
         return wav, sr, spect
 
+    def infer_stream(
+        self,
+        ref_file,
+        ref_text,
+        gen_text,
+        show_info=print,
+        target_rms=0.1,
+        cross_fade_duration=0.15,
+        cross_fade_curve="linear",  # linear | equal_power
+        sway_sampling_coef=-1,
+        cfg_strength=2,
+        cfg_interval=None,
+        cfg_decay=None,
+        cfg_null_interval=1,
+        nfe_step=32,
+        deep_cache_interval=1,
+        speed=1.0,
+        first_chunk_duration=2.0,
+        vocoder_window_frames=None,
+        seed=-1,
+        voice=None,
+        cancel_token=None,  # CancellationToken to cancel from another thread or set a deadline
+    ):
+        # yields audio (float numpy array at target_sample_rate) chunk by chunk, first chunk short for low latency
+        # vocoder_window_frames to also yield long chunks window by window as vocoded
+        if seed == -1:
+            seed = random.randint(0, sys.maxsize)
+        seed_everything(seed)
+        self.seed = seed
+
+        ref_file, ref_text = self.load_ref(ref_file, ref_text, voice)
+
+        yield from infer_process_stream(
+            ref_file,
+            ref_text,
+            gen_text,
+            self.ema_model,
+            self.vocoder,
+            first_chunk_duration=first_chunk_duration,
+            show_info=show_info,
+            mel_spec_type=self.mel_spec_type,
+            vocoder_window_frames=vocoder_window_frames,
+            progress=tqdm,
+            target_rms=target_rms,
+            cross_fade_duration=cross_fade_duration,
+            cross_fade_curve=cross_fade_curve,
+            nfe_step=nfe_step,
+            cfg_strength=cfg_strength,
+            cfg_interval=cfg_interval,
+            cfg_decay=cfg_decay,
+            cfg_null_interval=cfg_null_interval,
+            sway_sampling_coef=sway_sampling_coef,
+            deep_cache_interval=deep_cache_interval,
+            speed=speed,
+            device=self.device,
+            cancel_token=cancel_token,
+        )
+
 
 if __name__ == "__main__":
     f5tts = F5TTS()
@@ -50,7 +50,7 @@ def main():
     parser.add_argument("-to", "--tokenizer", default="pinyin", type=str, choices=["pinyin", "char"])
 
     parser.add_argument("-nfe", "--nfestep", default=32, type=int)
-    parser.add_argument("-o", "--odemethod", default="euler")
+    parser.add_argument("-o", "--odemethod", default="euler", help="euler | midpoint | heun | dpm++2m | unipc")
     parser.add_argument("-ss", "--swaysampling", default=-1, type=float)
 
     parser.add_argument("-t", "--testset", required=True)
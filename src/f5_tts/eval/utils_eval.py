@@ -9,7 +9,7 @@ import torchaudio
 from tqdm import tqdm
 
 from f5_tts.eval.ecapa_tdnn import ECAPA_TDNN_SMALL
-from f5_tts.model.modules import MelSpec
+from f5_tts.model.modules import MelSpec, resample
 from f5_tts.model.utils import convert_char_to_pinyin
 
 
@@ -112,9 +112,7 @@ def get_inference_prompt(
         if ref_rms < target_rms:
             ref_audio = ref_audio * target_rms / ref_rms
         assert ref_audio.shape[-1] > 5000, f"Empty prompt wav: {prompt_wav}, or torchaudio backend issue."
-        if ref_sr != target_sample_rate:
-            resampler = torchaudio.transforms.Resample(ref_sr, target_sample_rate)
-            ref_audio = resampler(ref_audio)
+        ref_audio = resample(ref_audio, ref_sr, target_sample_rate)
 
         # Text
         if len(prompt_text[-1].encode("utf-8")) == 1:
@@ -129,9 +127,7 @@ def get_inference_prompt(
         ref_mel_len = ref_audio.shape[-1] // hop_length
         if use_truth_duration:
             gt_audio, gt_sr = torchaudio.load(gt_wav)
-            if gt_sr != target_sample_rate:
-                resampler = torchaudio.transforms.Resample(gt_sr, target_sample_rate)
-                gt_audio = resampler(gt_audio)
+            gt_audio = resample(gt_audio, gt_sr, target_sample_rate)
             total_mel_len = ref_mel_len + int(gt_audio.shape[-1] / hop_length / speed)
 
             # # test vocoder resynthesis
@@ -386,10 +382,8 @@ def run_sim(args):
         wav1, sr1 = torchaudio.load(wav1)
         wav2, sr2 = torchaudio.load(wav2)
 
-        resample1 = torchaudio.transforms.Resample(orig_freq=sr1, new_freq=16000)
-        resample2 = torchaudio.transforms.Resample(orig_freq=sr2, new_freq=16000)
-        wav1 = resample1(wav1)
-        wav2 = resample2(wav2)
+        wav1 = resample(wav1, sr1, 16000)
+        wav2 = resample(wav2, sr2, 16000)
 
         if use_gpu:
             wav1 = wav1.cuda(device)
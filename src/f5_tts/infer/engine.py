@@ -0,0 +1,267 @@
+# Batching inference engine, one model & vocoder shared by requests from many threads or coroutines
+# requests are split into text chunks, chunks of similar total duration are sampled together as one batch
+
+import asyncio
+import queue
+import random
+import sys
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+
+import numpy as np
+import torch
+import torchaudio
+from torch.nn.utils.rnn import pad_sequence
+
+from f5_tts.infer.utils_infer import (
+    cfg_strength,
+    cross_fade_curve,
+    cross_fade_duration,
+    cross_fade_waves,
+    get_duration,
+    hop_length,
+    nfe_step,
+    split_gen_text,
+    sway_sampling_coef,
+    target_rms,
+    target_sample_rate,
+)
+from f5_tts.infer.scheduler import Scheduler, chunk_cost
+from f5_tts.infer.voices import VoiceProfile
+from f5_tts.model.modules import resample
+from f5_tts.model.utils import InferenceCancelled, convert_char_to_pinyin
+
+
+class InferenceEngine:
+    def __init__(
+        self,
+        model,
+        vocoder,
+        mel_spec_type="vocos",
+        max_batch_size=8,
+        bucket_frames=256,  # chunks with total duration (in mel frames) in the same bucket are batched together
+        max_wait=0.01,  # seconds to wait for more chunks to fill a batch
+        nfe_step=nfe_step,
+        cfg_strength=cfg_strength,
+        sway_sampling_coef=sway_sampling_coef,
+        target_rms=target_rms,
+        cross_fade_duration=cross_fade_duration,
+        cross_fade_curve=cross_fade_curve,
+        scheduler=None,  # Scheduler to order requests by cost and set budgets, one without budgets if None
+        **sample_kwargs,  # other options of model.sample, e.g. cfg_null_interval, deep_cache_interval
+    ):
+        self.model = model
+        self.vocoder = vocoder
+        self.mel_spec_type = mel_spec_type
+        self.device = next(model.parameters()).device
+
+        self.max_batch_size = max_batch_size
+        self.bucket_frames = bucket_frames
+        self.max_wait = max_wait
+        self.target_rms = target_rms
+        self.cross_fade_duration = cross_fade_duration
+        self.cross_fade_curve = cross_fade_curve
+        self.sample_kwargs = dict(
+            steps=nfe_step, cfg_strength=cfg_strength, sway_sampling_coef=sway_sampling_coef, **sample_kwargs
+        )
+
+        self.scheduler = scheduler if scheduler is not None else Scheduler()
+        self.closed = False
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def submit(
+        self, ref_audio, ref_text, gen_text, speed=1.0, fix_duration=None, seed=None, cancel_token=None
+    ) -> Future:
+        """
+        Queue a request, the future resolves to (wave, sample_rate, spectrogram) as infer_process returns.
+        Its noise is drawn from seed (random if None, kept as future.seed) whatever it is batched with.
+        Once cancel_token (CancellationToken) is cancelled or past deadline, or the future cancelled, the request's
+        chunks are dropped, those queued leaving the queue at once, and the future fails with InferenceCancelled.
+        Requests are served shortest first, raises AdmissionRejected if over budget of scheduler, else the future has
+        estimated_wait in seconds (None until the scheduler learned from some done).
+        """
+        assert not self.closed, "engine is closed"
+
+        # reference audio, path or (audio, sr) prepared in caller thread, or VoiceProfile prepared already
+        profile = ref_audio if isinstance(ref_audio, VoiceProfile) else None
+        if profile is not None:
+            audio, rms, ref_text = profile.get_audio(self.target_rms), profile.rms, profile.ref_text
+        else:
+            if isinstance(ref_audio, str):
+                audio, sr = torchaudio.load(ref_audio)
+            else:
+                audio, sr = ref_audio
+            if audio.shape[0] > 1:
+                audio = torch.mean(audio, dim=0, keepdim=True)
+            rms = torch.sqrt(torch.mean(torch.square(audio))).item()
+            if rms < self.target_rms:
+                audio = audio * self.target_rms / rms
+            audio = resample(audio, sr, target_sample_rate)
+        # precomputed mel if made at the same loudness
+        cond = profile.mel[0] if profile is not None and profile.target_rms == self.target_rms else None
+
+        # split text as infer_process does
+        gen_text_batches = split_gen_text(gen_text, ref_text, audio.shape[-1] / target_sample_rate)
+        if len(ref_text[-1].encode("utf-8")) == 1:
+            ref_text = ref_text + " "
+
+        if seed is None:
+            seed = random.randint(0, sys.maxsize)
+        future = Future()
+        future.seed = seed
+        request = dict(
+            future=future,
+            rms=rms,
+            waves=[None] * len(gen_text_batches),
+            spectrograms=[None] * len(gen_text_batches),
+            remaining=len(gen_text_batches),
+            cancel_token=cancel_token,
+        )
+
+        items, costs = [], []
+        ref_audio_len = audio.shape[-1] // hop_length
+        for i, gen_text in enumerate(gen_text_batches):
+            duration = get_duration(ref_audio_len, ref_text, gen_text, speed, fix_duration)
+            if profile is not None:
+                text = profile.get_text(gen_text)
+            else:
+                text = convert_char_to_pinyin([ref_text + gen_text])[0]
+            items.append(
+                dict(
+                    request=request,
+                    index=i,
+                    audio=audio,
+                    cond=cond,
+                    ref_audio_len=ref_audio_len,
+                    text=text,
+                    duration=duration,
+                    seed=seed + i,  # deterministic noise per chunk, whatever the batch
+                    cost=chunk_cost(duration, self.sample_kwargs["steps"], self.sample_kwargs["cfg_strength"]),
+                )
+            )
+            costs.append(items[-1]["cost"])
+
+        future.estimated_wait = self.scheduler.put(items, costs, cancel_token)
+        # chunks still queued leave it (and its budget) once the request is cancelled, or failed by another chunk
+        future.add_done_callback(lambda future: self.scheduler.cancel(items))
+        if cancel_token is not None:
+            cancel_token.add_callback(lambda reason: self.fail(request, InferenceCancelled(reason)))
+        return future
+
+    def infer(self, ref_audio, ref_text, gen_text, **kwargs):
+        return self.submit(ref_audio, ref_text, gen_text, **kwargs).result()
+
+    async def infer_async(self, ref_audio, ref_text, gen_text, **kwargs):
+        return await asyncio.wrap_future(self.submit(ref_audio, ref_text, gen_text, **kwargs))
+
+    def close(self):
+        """Finish queued requests and stop the worker."""
+        self.closed = True
+        self.scheduler.close()
+        self.worker.join()
+
+    # worker
+
+    def run(self):
+        while True:
+            item = self.scheduler.get()
+            if item is None:
+                break
+
+            # first chunk as scheduled, batched with others of its bucket queued or arriving shortly after, up to a
+            # full batch, chunks of other buckets stay queued in order
+            bucket = item["duration"] // self.bucket_frames
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                try:
+                    item = self.scheduler.get(
+                        timeout=max(deadline - time.monotonic(), 0),
+                        match=lambda queued: queued["duration"] // self.bucket_frames == bucket,
+                    )
+                except queue.Empty:
+                    break
+                if item is None:
+                    break
+                batch.append(item)
+
+            waiting = [self.is_waiting(item) for item in batch]  # not cancelled or failed
+            self.scheduler.done(sum(item["cost"] for item, w in zip(batch, waiting) if not w))
+            batch = [item for item, w in zip(batch, waiting) if w]
+            if batch:
+                start = time.perf_counter()
+                self.infer_batch(batch)
+                self.scheduler.done(sum(item["cost"] for item in batch), time.perf_counter() - start)
+
+    def infer_batch(self, batch):
+        try:
+            with torch.inference_mode():
+                # reference mels not precomputed (by a voice profile), extracted at once for the batch
+                audio = [item["audio"][0].to(self.device) for item in batch if item["cond"] is None]
+                if audio:
+                    audio_lens = torch.tensor([len(a) for a in audio], device=self.device)
+                    mels = self.model.mel_spec(pad_sequence(audio, batch_first=True), audio_lens).permute(0, 2, 1)
+                    frame_lens = self.model.mel_spec.get_frame_lens(audio_lens).tolist()
+                    extracted = iter([mel[:n] for mel, n in zip(mels, frame_lens)])
+                cond = [item["cond"].to(self.device) if item["cond"] is not None else next(extracted) for item in batch]
+                lens = [len(c) for c in cond]
+                duration = [
+                    max(item["duration"], ref_len + 1, len(item["text"]) + 1) for item, ref_len in zip(batch, lens)
+                ]
+
+                generated, _ = self.model.sample(
+                    cond=pad_sequence(cond, batch_first=True),
+                    text=[item["text"] for item in batch],
+                    duration=torch.tensor(duration, device=self.device),
+                    lens=torch.tensor(lens, device=self.device),
+                    seed=[item["seed"] for item in batch],
+                    callback=lambda step, t, x: self.check_cancelled(batch),
+                    **self.sample_kwargs,
+                )
+                generated = generated.to(torch.float32)
+
+                for item, gen, dur in zip(batch, generated, duration):
+                    generated_mel_spec = gen[item["ref_audio_len"] : dur].permute(1, 0).unsqueeze(0)
+                    if self.mel_spec_type == "vocos":
+                        generated_wave = self.vocoder.decode(generated_mel_spec)
+                    elif self.mel_spec_type == "bigvgan":
+                        generated_wave = self.vocoder(generated_mel_spec)
+                    rms = item["request"]["rms"]
+                    if rms < self.target_rms:
+                        generated_wave = generated_wave * rms / self.target_rms
+
+                    self.finish(item, generated_wave.squeeze().cpu().numpy(), generated_mel_spec[0].cpu().numpy())
+
+        except Exception as e:
+            for item in batch:
+                self.fail(item["request"], e)
+
+    def fail(self, request, e):
+        try:
+            request["future"].set_exception(e)
+        except InvalidStateError:
+            pass  # done already, also from the thread cancelling it
+
+    def is_waiting(self, item):
+        request = item["request"]
+        token = request["cancel_token"]
+        if token is not None and token.cancelled:
+            self.fail(request, InferenceCancelled(token.reason))
+        return not request["future"].done()
+
+    def check_cancelled(self, batch):
+        # between sampling steps, fail cancelled requests (all checked) and stop the batch once none of it waits
+        if not any([self.is_waiting(item) for item in batch]):
+            raise InferenceCancelled("all requests of batch cancelled")
+
+    def finish(self, item, wave, spectrogram):
+        request = item["request"]
+        request["waves"][item["index"]] = wave
+        request["spectrograms"][item["index"]] = spectrogram
+        request["remaining"] -= 1
+        if request["remaining"] == 0 and not request["future"].done():
+            final_wave = cross_fade_waves(request["waves"], self.cross_fade_duration, self.cross_fade_curve)
+            combined_spectrogram = np.concatenate(request["spectrograms"], axis=1)
+            request["future"].set_result((final_wave, target_sample_rate, combined_spectrogram))
@@ -17,6 +17,7 @@ from f5_tts.infer.utils_infer import (
     preprocess_ref_audio_text,
     remove_silence_for_generated_wav,
 )
+from f5_tts.infer.voices import VoiceRegistry
 from f5_tts.model import DiT, UNetT
 
 parser = argparse.ArgumentParser(
@@ -47,6 +48,16 @@ parser.add_argument(
 )
 parser.add_argument("-r", "--ref_audio", type=str, help="Reference audio file < 15 seconds.")
 parser.add_argument("-s", "--ref_text", type=str, default="666", help="Subtitle for the reference audio.")
+parser.add_argument(
+    "--voices_dir",
+    type=str,
+    help="Folder of preprocessed reference voices, reused across runs.",
+)
+parser.add_argument(
+    "--voice",
+    type=str,
+    help="Voice in --voices_dir used as main voice. Created from --ref_audio & --ref_text if not there yet.",
+)
 parser.add_argument(
     "-t",
     "--gen_text",
@@ -103,7 +114,7 @@ if "infer/examples/" in gen_file:
     gen_file = str(files("f5_tts").joinpath(f"{gen_file}"))
 if "voices" in config:
     for voice in config["voices"]:
-        voice_ref_audio = config["voices"][voice]["ref_audio"]
+        voice_ref_audio = config["voices"][voice].get("ref_audio", "")
         if "infer/examples/" in voice_ref_audio:
             config["voices"][voice]["ref_audio"] = str(files("f5_tts").joinpath(f"{voice_ref_audio}"))
 
@@ -116,6 +127,9 @@ ckpt_file = args.ckpt_file if args.ckpt_file else ""
 vocab_file = args.vocab_file if args.vocab_file else ""
 remove_silence = args.remove_silence if args.remove_silence else config["remove_silence"]
 speed = args.speed
+voices_dir = args.voices_dir if args.voices_dir else config.get("voices_dir", "")
+main_voice_name = args.voice if args.voice else config.get("voice", "")
+voice_registry = VoiceRegistry(voices_dir, mel_spec_type=args.vocoder_name) if voices_dir else None
 
 wave_path = Path(output_dir) / output_file
 # spectrogram_path = Path(output_dir) / "infer_cli_out.png"
@@ -165,17 +179,30 @@ ema_model = load_model(model_cls, model_cfg, ckpt_file, mel_spec_type=mel_spec_t
 
 def main_process(ref_audio, ref_text, text_gen, model_obj, mel_spec_type, remove_silence, speed):
     main_voice = {"ref_audio": ref_audio, "ref_text": ref_text}
+    if main_voice_name:
+        main_voice["voice"] = main_voice_name
     if "voices" not in config:
         voices = {"main": main_voice}
     else:
         voices = config["voices"]
         voices["main"] = main_voice
     for voice in voices:
-        voices[voice]["ref_audio"], voices[voice]["ref_text"] = preprocess_ref_audio_text(
-            voices[voice]["ref_audio"], voices[voice]["ref_text"]
-        )
-        print("Voice:", voice)
-        print("Ref_audio:", voices[voice]["ref_audio"])
+        if "voice" in voices[voice]:
+            # preprocessed voice, created from ref_audio & ref_text on first use
+            assert voice_registry is not None, "voices_dir is needed to use voice"
+            name = voices[voice]["voice"]
+            if name in voice_registry:
+                profile = voice_registry.get(name)
+            else:
+                profile = voice_registry.add(name, voices[voice]["ref_audio"], voices[voice].get("ref_text", ""))
+            voices[voice]["ref_audio"], voices[voice]["ref_text"] = profile, profile.ref_text
+            print("Voice:", voice, f"({name} in {voices_dir})")
+        else:
+            print("Voice:", voice)
+            print("Ref_audio:", voices[voice]["ref_audio"])
+            voices[voice]["ref_audio"], voices[voice]["ref_text"] = preprocess_ref_audio_text(
+                voices[voice]["ref_audio"], voices[voice]["ref_text"]
+            )
         print("Ref_text:", voices[voice]["ref_text"])
 
     generated_audio_segments = []
@@ -3,7 +3,9 @@
 
 import re
 import tempfile
+import threading
 from collections import OrderedDict
+from contextlib import contextmanager
 from importlib.resources import files
 
 import click
@@ -38,6 +40,7 @@ from f5_tts.infer.utils_infer import (
     remove_silence_for_generated_wav,
     save_spectrogram,
 )
+from f5_tts.model.utils import CancellationToken
 
 
 DEFAULT_TTS_MODEL = "F5-TTS"
@@ -101,9 +104,45 @@ def generate_response(messages, model, tokenizer):
     return tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
 
 
+# tokens of generations running for each browser session, cancelled once its page is closed (no use generating on)
+session_tokens = {}
+session_tokens_lock = threading.Lock()
+
+
+@contextmanager
+def session_cancel_token(request: gr.Request = None):
+    token = CancellationToken()
+    session = request.session_hash if request is not None else None
+    with session_tokens_lock:
+        session_tokens.setdefault(session, set()).add(token)
+    try:
+        yield token
+    finally:
+        with session_tokens_lock:
+            tokens = session_tokens.get(session, set())
+            tokens.discard(token)
+            if not tokens:
+                session_tokens.pop(session, None)
+
+
+def cancel_session(request: gr.Request):
+    with session_tokens_lock:
+        tokens = session_tokens.pop(request.session_hash, set())
+    for token in tokens:
+        token.cancel("session closed")
+
+
 @gpu_decorator
 def infer(
-    ref_audio_orig, ref_text, gen_text, model, remove_silence, cross_fade_duration=0.15, speed=1, show_info=gr.Info
+    ref_audio_orig,
+    ref_text,
+    gen_text,
+    model,
+    remove_silence,
+    cross_fade_duration=0.15,
+    speed=1,
+    show_info=gr.Info,
+    cancel_token=None,
 ):
     ref_audio, ref_text = preprocess_ref_audio_text(ref_audio_orig, ref_text, show_info=show_info)
 
@@ -134,6 +173,7 @@ def infer(
         speed=speed,
         show_info=show_info,
         progress=gr.Progress(),
+        cancel_token=cancel_token,
     )
 
     # Remove silence
@@ -204,16 +244,19 @@ with gr.Blocks() as app_tts:
         remove_silence,
         cross_fade_duration_slider,
         speed_slider,
+        request: gr.Request = None,
     ):
-        audio_out, spectrogram_path, ref_text_out = infer(
-            ref_audio_input,
-            ref_text_input,
-            gen_text_input,
-            tts_model_choice,
-            remove_silence,
-            cross_fade_duration_slider,
-            speed_slider,
-        )
+        with session_cancel_token(request) as cancel_token:
+            audio_out, spectrogram_path, ref_text_out = infer(
+                ref_audio_input,
+                ref_text_input,
+                gen_text_input,
+                tts_model_choice,
+                remove_silence,
+                cross_fade_duration_slider,
+                speed_slider,
+                cancel_token=cancel_token,
+            )
         return audio_out, spectrogram_path, gr.update(value=ref_text_out)
 
     generate_btn.click(
@@ -412,6 +455,7 @@ with gr.Blocks() as app_multistyle:
 
     @gpu_decorator
     def generate_multistyle_speech(
+        request: gr.Request,  # before *args, for gradio to pass it
         gen_text,
         *args,
     ):
@@ -453,9 +497,17 @@ with gr.Blocks() as app_multistyle:
             ref_text = speech_types[current_style].get("ref_text", "")
 
             # Generate speech for this segment
-            audio_out, _, ref_text_out = infer(
-                ref_audio, ref_text, text, tts_model_choice, remove_silence, 0, show_info=print
-            )  # show_info=print no pull to top when generating
+            with session_cancel_token(request) as cancel_token:
+                audio_out, _, ref_text_out = infer(
+                    ref_audio,
+                    ref_text,
+                    text,
+                    tts_model_choice,
+                    remove_silence,
+                    0,
+                    show_info=print,
+                    cancel_token=cancel_token,
+                )  # show_info=print no pull to top when generating
             sr, audio_data = audio_out
 
             generated_audio_segments.append(audio_data)
@@ -632,7 +684,7 @@ Have a conversation with an AI using your reference voice!
             return history, conv_state, ""
 
         @gpu_decorator
-        def generate_audio_response(history, ref_audio, ref_text, remove_silence):
+        def generate_audio_response(history, ref_audio, ref_text, remove_silence, request: gr.Request = None):
             """Generate TTS audio for AI response"""
             if not history or not ref_audio:
                 return None
@@ -641,16 +693,18 @@ Have a conversation with an AI using your reference voice!
             if not last_ai_response:
                 return None
 
-            audio_result, _, ref_text_out = infer(
-                ref_audio,
-                ref_text,
-                last_ai_response,
-                tts_model_choice,
-                remove_silence,
-                cross_fade_duration=0.15,
-                speed=1.0,
-                show_info=print,  # show_info=print no pull to top when generating
-            )
+            with session_cancel_token(request) as cancel_token:
+                audio_result, _, ref_text_out = infer(
+                    ref_audio,
+                    ref_text,
+                    last_ai_response,
+                    tts_model_choice,
+                    remove_silence,
+                    cross_fade_duration=0.15,
+                    speed=1.0,
+                    show_info=print,  # show_info=print no pull to top when generating
+                    cancel_token=cancel_token,
+                )
             return audio_result, gr.update(value=ref_text_out)
 
         def clear_conversation():
@@ -819,6 +873,10 @@ If you're having issues, try converting your reference audio to WAV or MP3, clip
         ["Basic-TTS", "Multi-Speech", "Voice-Chat", "Credits"],
     )
 
+    # stop generating for a closed page, at the next sampling step
+    if hasattr(app, "unload"):  # gradio 4.17+
+        app.unload(cancel_session)
+
 
 @click.command()
 @click.option("--port", "-p", default=None, type=int, help="Port to run the app on")
@@ -0,0 +1,198 @@
+# Compute-cost-aware scheduling for serving, requests estimated from their total mel frames, steps and guidance
+# shortest job first with aging, so short requests are not stuck behind long ones, nor long ones starved
+
+import heapq
+import itertools
+import math
+import queue
+import threading
+import time
+
+from f5_tts.infer.utils_infer import (
+    cfg_strength,
+    fix_duration,
+    get_duration,
+    hop_length,
+    load_ref_audio,
+    nfe_step,
+    speed,
+    split_gen_text,
+    target_sample_rate,
+)
+
+
+def chunk_cost(duration, nfe_step=nfe_step, cfg_strength=cfg_strength):
+    # transformer evaluations (both branches if guided) x attention over total mel frames, dominant for long chunks
+    evaluations = nfe_step * (2 if cfg_strength >= 1e-5 else 1)
+    return evaluations * duration**2
+
+
+def estimate_cost(
+    ref_audio,
+    ref_text,
+    gen_text,
+    nfe_step=nfe_step,
+    cfg_strength=cfg_strength,
+    speed=speed,
+    fix_duration=fix_duration,
+    first_chunk_duration=None,
+):
+    """
+    Estimated compute cost of each text chunk of a request, text split and chunk durations as infer_process does
+    (infer_process_stream with first_chunk_duration). ref_audio is (audio, sr) or a VoiceProfile.
+    """
+    ref_audio, ref_text, ref_duration = load_ref_audio(ref_audio, ref_text)
+    gen_text_batches = split_gen_text(gen_text, ref_text, ref_duration, first_chunk_duration)
+    ref_audio_len = int(ref_duration * target_sample_rate) // hop_length
+    if len(ref_text[-1].encode("utf-8")) == 1:
+        ref_text = ref_text + " "
+    return [
+        chunk_cost(get_duration(ref_audio_len, ref_text, text, speed, fix_duration), nfe_step, cfg_strength)
+        for text in gen_text_batches
+    ]
+
+
+class AdmissionRejected(Exception):
+    pass
+
+
+class Scheduler:
+    """
+    Queue of jobs (requests, each one or more items) served shortest estimated cost first. Waiting ages a job, its
+    cost counted half for every `aging` seconds waited: a 4x costlier job queued 2 * aging seconds earlier goes first.
+    Jobs over max_request_cost, or past max_queue_cost of work queued, are rejected with AdmissionRejected.
+    A job cancelled while queued (cancel(), or its cancel_token) leaves the queue at once, no longer counted.
+    Seconds per unit of cost are learned from done() to estimate waits. Thread-safe, get() as queue.Queue.get.
+    """
+
+    def __init__(self, max_request_cost=None, max_queue_cost=None, aging=10.0, seconds_per_cost=None):
+        self.max_request_cost = max_request_cost
+        self.max_queue_cost = max_queue_cost
+        self.aging = aging
+        self.seconds_per_cost = seconds_per_cost  # running average, None until a job is done
+        self.heap = []  # (priority, order, item, cost of item, cancel_token of job)
+        self.order = itertools.count()
+        self.queued_cost = 0
+        self.running_cost = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def priority(self, cost):
+        # cost * 2 ** -(waited / aging) in log scale, ordering of queued jobs only changes as new ones arrive
+        return math.log2(max(cost, 1)) + time.monotonic() / self.aging
+
+    def estimate_wait(self, cost=0):
+        """Seconds until a job of cost queued now would start, None before any job is done."""
+        self.purge()
+        with self.condition:
+            return self.queued_wait(cost)
+
+    def queued_wait(self, cost):
+        # estimate_wait with the lock held
+        if self.seconds_per_cost is None:
+            return None
+        priority = self.priority(cost)
+        ahead = sum(entry[3] for entry in self.heap if entry[0] <= priority)
+        return (ahead + self.running_cost) * self.seconds_per_cost
+
+    def admit(self, cost):
+        """Estimated wait in seconds (or None) of a job of cost queued now, raises AdmissionRejected if over budget."""
+        self.purge()
+        with self.condition:
+            return self.check_budget(cost)
+
+    def check_budget(self, cost):
+        # admit with the lock held
+        if self.max_request_cost is not None and cost > self.max_request_cost:
+            raise AdmissionRejected(f"request too long, estimated cost {cost:.3g} over {self.max_request_cost:.3g}")
+        wait = self.queued_wait(cost)
+        if self.max_queue_cost is not None and self.queued_cost + cost > self.max_queue_cost:
+            raise AdmissionRejected("server busy" + (f", estimated wait {wait:.1f}s" if wait is not None else ""))
+        return wait
+
+    def put(self, items, costs, cancel_token=None):
+        """
+        Queue items of a job with cost of each if admitted, return estimated wait in seconds (or None).
+        Once cancel_token (CancellationToken) is cancelled, items of the job not taken yet are dropped.
+        """
+        cost = sum(costs)
+        self.purge()
+        with self.condition:
+            assert not self.closed, "scheduler is closed"
+            wait = self.check_budget(cost)
+            priority = self.priority(cost)
+            for item, item_cost in zip(items, costs):
+                heapq.heappush(self.heap, (priority, next(self.order), item, item_cost, cancel_token))
+            self.queued_cost += cost
+            self.condition.notify(len(items))
+        if cancel_token is not None:
+            cancel_token.add_callback(lambda reason: self.cancel(items))
+        return wait
+
+    def cancel(self, items):
+        """Drop items not taken yet (of a job cancelled), their cost no longer queued, return how many dropped."""
+        ids = set(map(id, items))
+        return self.remove(lambda entry: id(entry[2]) in ids)
+
+    def purge(self):
+        # drop jobs whose token went past deadline unnoticed, so they do not count against budget or waits
+        with self.condition:
+            tokens = {id(entry[4]): entry[4] for entry in self.heap if entry[4] is not None}
+        # checked outside the lock, as cancelling runs the token's callbacks (see put)
+        expired = set(id(token) for token in tokens.values() if token.cancelled)
+        if expired:
+            self.remove(lambda entry: id(entry[4]) in expired)
+
+    def remove(self, dropped):
+        with self.condition:
+            removed = [entry for entry in self.heap if dropped(entry)]
+            if removed:
+                self.heap = [entry for entry in self.heap if not dropped(entry)]
+                heapq.heapify(self.heap)
+                self.queued_cost -= sum(entry[3] for entry in removed)
+            return len(removed)
+
+    def get(self, block=True, timeout=None, match=None):
+        """
+        Next item, or next one match(item) is true for, others staying queued in order. Counted as running until
+        done(), None once closed and all (matching) taken.
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.find(match) or self.closed, timeout if block else 0):
+                raise queue.Empty
+            entry = self.find(match)
+            if entry is None:
+                return None
+            if entry is self.heap[0]:
+                heapq.heappop(self.heap)
+            else:
+                self.heap.remove(entry)
+                heapq.heapify(self.heap)
+            self.queued_cost -= entry[3]
+            self.running_cost += entry[3]
+            return entry[2]
+
+    def find(self, match=None):
+        # first queued entry (of items match is true for), None if none
+        if match is None:
+            return self.heap[0] if self.heap else None
+        return min((entry for entry in self.heap if match(entry[2])), default=None)
+
+    def done(self, cost, seconds=None):
+        """Taken work of cost finished (or dropped), with seconds it took to learn from."""
+        with self.condition:
+            self.running_cost -= cost
+            if seconds is not None and cost > 0:
+                rate = seconds / cost
+                self.seconds_per_cost = (
+                    rate if self.seconds_per_cost is None else 0.8 * self.seconds_per_cost + 0.2 * rate
+                )
+
+    def close(self):
+        """Let get() return None once queued items are taken."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def __len__(self):
+        return len(self.heap)
@@ -0,0 +1,206 @@
+# Silence detection and trimming on sample arrays, vectorized with cumulative sums of squared samples
+# same results as pydub.silence on AudioSegment.get_array_of_samples(), without slicing audio millisecond by millisecond
+# samples: numpy array or torch tensor, (frames,) or (frames, channels), int pcm as pydub holds or float in [-1, 1]
+
+import math
+
+import numpy as np
+import torch
+
+
+def to_array(samples):
+    if isinstance(samples, torch.Tensor):
+        samples = samples.detach().cpu().numpy()
+    samples = np.asarray(samples)
+    return samples[:, None] if samples.ndim == 1 else samples
+
+
+def max_amplitude(samples):
+    # as AudioSegment.max_possible_amplitude, full scale 1 for float
+    if np.issubdtype(samples.dtype, np.integer):
+        return 2 ** (samples.dtype.itemsize * 8) / 2
+    return 1.0
+
+
+def length_ms(num_frames, frame_rate):
+    # as len(AudioSegment)
+    return round(1000 * (float(num_frames) / frame_rate))
+
+
+def db_to_float(db):
+    return 10 ** (db / 20)
+
+
+def ratio_to_db(ratio):
+    return 20 * math.log(ratio, 10) if ratio > 0 else -float("inf")
+
+
+class Energy:
+    """Prefix sums of squared samples, rms of any millisecond range in O(1) as AudioSegment[start:end].rms."""
+
+    def __init__(self, samples, frame_rate, cumsum=None):
+        self.samples = to_array(samples)
+        self.frame_rate = frame_rate
+        self.num_frames, self.channels = self.samples.shape
+        self.len_ms = length_ms(self.num_frames, frame_rate)
+        self.is_int = np.issubdtype(self.samples.dtype, np.integer)
+        self.max_amplitude = max_amplitude(self.samples)
+
+        if cumsum is None:
+            # exact as audioop for up to 16 bit pcm, wider summed in float64
+            dtype = np.int64 if self.is_int and self.samples.dtype.itemsize <= 2 else np.float64
+            square = self.samples.astype(dtype)
+            np.multiply(square, square, out=square)
+            square = square[:, 0] if self.channels == 1 else square.sum(axis=1)
+            cumsum = np.empty(self.num_frames + 1, dtype=dtype)
+            cumsum[0] = 0
+            np.cumsum(square, out=cumsum[1:])
+        self.cumsum = cumsum
+
+    def frames(self, ms):
+        # as AudioSegment._parse_position for non-negative ms
+        return (np.asarray(ms) * (self.frame_rate / 1000.0)).astype(np.int64)
+
+    def rms(self, start_ms, end_ms):
+        start, end = self.frames(start_ms), self.frames(end_ms)
+        available = np.minimum(end, self.num_frames) - np.minimum(start, self.num_frames)
+        # slice past the end is padded with silent frames, unless nothing left to pad from
+        count = np.where(available > 0, end - start, 0) * self.channels
+        total = self.cumsum[np.minimum(end, self.num_frames)] - self.cumsum[np.minimum(start, self.num_frames)]
+        rms = np.sqrt(total.astype(np.float64) / np.maximum(count, 1))
+        if self.is_int:
+            rms = np.floor(rms)  # audioop.rms truncates
+        return np.where(count > 0, rms, 0.0)
+
+    def db_threshold(self, silence_threshold, strict=False):
+        # rms compared with this as dBFS with silence_threshold, dBFS computed as AudioSegment.dBFS for int pcm
+        if not self.is_int:
+            return db_to_float(silence_threshold) * self.max_amplitude
+
+        def above(r):
+            db = ratio_to_db(r / self.max_amplitude)
+            return db > silence_threshold if strict else db >= silence_threshold
+
+        r = max(int(db_to_float(silence_threshold) * self.max_amplitude) - 2, 1)
+        while not above(r):
+            r += 1
+        while r > 1 and above(r - 1):
+            r -= 1
+        return r  # smallest rms above (or at, if not strict) threshold
+
+    def slice(self, start_ms=None, end_ms=None, energy=False):
+        # as AudioSegment[start_ms:end_ms], or Energy of it sharing prefix sums if energy
+        start_ms = min(start_ms if start_ms is not None else 0, self.len_ms)
+        end_ms = min(end_ms if end_ms is not None else self.len_ms, self.len_ms)
+        if start_ms < 0:
+            start_ms = self.len_ms - abs(start_ms)
+        if end_ms < 0:
+            end_ms = self.len_ms - abs(end_ms)
+        start, end = int(self.frames(start_ms)), int(self.frames(end_ms))
+        data = self.samples[start:end]
+        missing = (end - start) - len(data) if len(data) > 0 else 0
+        if missing > 0:
+            data = np.concatenate([data, np.zeros((missing, self.channels), dtype=data.dtype)])
+        if not energy:
+            return data
+
+        start = min(start, self.num_frames)
+        cumsum = self.cumsum[start : start + len(data) - missing + 1]  # offset cancels out in differences
+        if missing > 0:
+            cumsum = np.concatenate([cumsum, np.full(missing, cumsum[-1], dtype=cumsum.dtype)])
+        return Energy(data, self.frame_rate, cumsum=cumsum)
+
+
+def detect_silence(samples, frame_rate, min_silence_len=1000, silence_thresh=-16, seek_step=1, energy=None):
+    """Silent sections [start, end] in milliseconds, as pydub.silence.detect_silence."""
+    energy = energy or Energy(samples, frame_rate)
+    seg_len = energy.len_ms
+    if seg_len < min_silence_len:
+        return []
+
+    silence_thresh = db_to_float(silence_thresh) * energy.max_amplitude
+
+    last_slice_start = seg_len - min_silence_len
+    slice_starts = np.arange(0, last_slice_start + 1, seek_step)
+    if last_slice_start % seek_step:
+        slice_starts = np.append(slice_starts, last_slice_start)
+
+    silence_starts = slice_starts[energy.rms(slice_starts, slice_starts + min_silence_len) <= silence_thresh]
+    if len(silence_starts) == 0:
+        return []
+
+    # combine into ranges, overlapping silent slices are one range even if not continuous
+    prev, cur = silence_starts[:-1], silence_starts[1:]
+    split = (cur != prev + seek_step) & (cur > prev + min_silence_len)
+    range_starts = np.concatenate([silence_starts[:1], cur[split]])
+    range_ends = np.concatenate([prev[split], silence_starts[-1:]]) + min_silence_len
+    return [[int(start), int(end)] for start, end in zip(range_starts, range_ends)]
+
+
+def detect_nonsilent(samples, frame_rate, min_silence_len=1000, silence_thresh=-16, seek_step=1, energy=None):
+    """Non-silent sections [start, end] in milliseconds, as pydub.silence.detect_nonsilent."""
+    energy = energy or Energy(samples, frame_rate)
+    silent_ranges = detect_silence(samples, frame_rate, min_silence_len, silence_thresh, seek_step, energy=energy)
+    len_seg = energy.len_ms
+
+    if not silent_ranges:
+        return [[0, len_seg]]
+    if silent_ranges[0][0] == 0 and silent_ranges[0][1] == len_seg:
+        return []
+
+    prev_end_i = 0
+    nonsilent_ranges = []
+    for start_i, end_i in silent_ranges:
+        nonsilent_ranges.append([prev_end_i, start_i])
+        prev_end_i = end_i
+    if end_i != len_seg:
+        nonsilent_ranges.append([prev_end_i, len_seg])
+    if nonsilent_ranges[0] == [0, 0]:
+        nonsilent_ranges.pop(0)
+    return nonsilent_ranges
+
+
+def split_on_silence(samples, frame_rate, min_silence_len=1000, silence_thresh=-16, keep_silence=100, seek_step=1):
+    """Sample arrays (frames, channels) split on silent sections, as pydub.silence.split_on_silence."""
+    energy = Energy(samples, frame_rate)
+    if isinstance(keep_silence, bool):
+        keep_silence = energy.len_ms if keep_silence else 0
+
+    output_ranges = [
+        [start - keep_silence, end + keep_silence]
+        for start, end in detect_nonsilent(
+            samples, frame_rate, min_silence_len, silence_thresh, seek_step, energy=energy
+        )
+    ]
+    for range_i, range_ii in zip(output_ranges, output_ranges[1:]):
+        if range_ii[0] < range_i[1]:
+            range_i[1] = (range_i[1] + range_ii[0]) // 2
+            range_ii[0] = range_i[1]
+
+    return [energy.slice(max(start, 0), min(end, energy.len_ms)) for start, end in output_ranges]
+
+
+def detect_leading_silence(samples, frame_rate, silence_threshold=-50.0, chunk_size=10, energy=None):
+    """Millisecond the leading silence ends, as pydub.silence.detect_leading_silence."""
+    assert chunk_size > 0
+    energy = energy or Energy(samples, frame_rate)
+    starts = np.arange(0, energy.len_ms, chunk_size)
+    rms = energy.rms(starts, np.minimum(starts + chunk_size, energy.len_ms))
+    loud = np.flatnonzero(rms >= energy.db_threshold(silence_threshold))
+    return int(starts[loud[0]]) if len(loud) else energy.len_ms
+
+
+def remove_silence_edges(samples, frame_rate, silence_threshold=-42):
+    """Samples (frames, channels) with leading and trailing silence removed, as utils_infer did on AudioSegment."""
+    energy = Energy(samples, frame_rate)
+    energy = energy.slice(detect_leading_silence(samples, frame_rate, silence_threshold, energy=energy), energy=True)
+
+    # trailing silence, checked millisecond by millisecond from the end
+    starts = np.arange(energy.len_ms)
+    loud = np.flatnonzero(energy.rms(starts, starts + 1) >= energy.db_threshold(silence_threshold, strict=True))
+    trailing_ms = energy.len_ms - 1 - loud[-1] if len(loud) else energy.len_ms
+
+    non_silent_end_duration = energy.num_frames / frame_rate
+    for _ in range(trailing_ms):  # same float steps as before, decides where to cut
+        non_silent_end_duration -= 0.001
+    return energy.slice(None, int(non_silent_end_duration * 1000))
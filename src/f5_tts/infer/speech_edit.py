@@ -8,6 +8,7 @@ import torchaudio
 
 from f5_tts.infer.utils_infer import load_checkpoint, load_vocoder, save_spectrogram
 from f5_tts.model import CFM, DiT, UNetT
+from f5_tts.model.modules import resample
 from f5_tts.model.utils import convert_char_to_pinyin, get_tokenizer
 
 device = "cuda" if torch.cuda.is_available() else "mps" if torch.backends.mps.is_available() else "cpu"
@@ -36,7 +37,7 @@ ckpt_step = 1200000
 
 nfe_step = 32  # 16, 32
 cfg_strength = 2.0
-ode_method = "euler"  # euler | midpoint
+ode_method = "euler"  # euler | midpoint | heun | dpm++2m | unipc
 sway_sampling_coef = -1.0
 speed = 1.0
 
@@ -123,9 +124,7 @@ if audio.shape[0] > 1:
 rms = torch.sqrt(torch.mean(torch.square(audio)))
 if rms < target_rms:
     audio = audio * target_rms / rms
-if sr != target_sample_rate:
-    resampler = torchaudio.transforms.Resample(sr, target_sample_rate)
-    audio = resampler(audio)
+audio = resample(audio, sr, target_sample_rate)
 offset = 0
 audio_ = torch.zeros(1, 0)
 edit_mask = torch.zeros(1, 0, dtype=torch.bool)
@@ -164,7 +163,7 @@ duration = audio.shape[-1] // hop_length
 
 # Inference
 with torch.inference_mode():
-    generated, trajectory = model.sample(
+    generated, _ = model.sample(
         cond=audio,
         text=final_text_list,
         duration=duration,
@@ -8,7 +8,9 @@ sys.path.append(f"../../{os.path.dirname(os.path.abspath(__file__))}/third_party
 
 import hashlib
 import re
-import tempfile
+import sqlite3
+import time
+from functools import lru_cache
 from importlib.resources import files
 
 import matplotlib
@@ -17,22 +19,23 @@ matplotlib.use("Agg")
 
 import matplotlib.pylab as plt
 import numpy as np
+import soundfile as sf
 import torch
 import torchaudio
 import tqdm
 from huggingface_hub import snapshot_download, hf_hub_download
-from pydub import AudioSegment, silence
+from pydub import AudioSegment
 from transformers import pipeline
 from vocos import Vocos
 
+from f5_tts.infer import silence
 from f5_tts.model import CFM
+from f5_tts.model.modules import resample
 from f5_tts.model.utils import (
     get_tokenizer,
     convert_char_to_pinyin,
 )
 
-_ref_audio_cache = {}
-
 device = "cuda" if torch.cuda.is_available() else "mps" if torch.backends.mps.is_available() else "cpu"
 
 # -----------------------------------------
@@ -45,12 +48,18 @@ n_fft = 1024
 mel_spec_type = "vocos"
 target_rms = 0.1
 cross_fade_duration = 0.15
-ode_method = "euler"
+cross_fade_curve = "linear"  # linear | equal_power, keeps loudness constant over the fade for uncorrelated chunks
+ode_method = "euler"  # euler | midpoint | heun | dpm++2m | unipc, few-step (8~16 nfe) prefer unipc
 nfe_step = 32  # 16, 32
 cfg_strength = 2.0
+cfg_interval = None  # (t_min, t_max) to only apply guidance within, e.g. (0.0, 0.8)
+cfg_decay = None  # None | linear | cosine, decay cfg strength to zero along t
+cfg_null_interval = 1  # 2 to evaluate uncond branch every other step, reusing last one between
 sway_sampling_coef = -1.0
+deep_cache_interval = 1  # > 1 (e.g. 2, 3) to reuse middle dit blocks across ode steps, faster but lower quality
 speed = 1.0
 fix_duration = None
+batch_chunks = False  # sample all text chunks at once, faster for long text if memory allows
 
 # -----------------------------------------
 
@@ -58,13 +67,14 @@ fix_duration = None
 # chunk text into smaller pieces
 
 
-def chunk_text(text, max_chars=135):
+def chunk_text(text, max_chars=135, first_max_chars=None):
     """
     Splits the input text into chunks, each with a maximum number of characters.
 
     Args:
         text (str): The text to be split.
         max_chars (int): The maximum number of characters per chunk.
+        first_max_chars (int): The maximum number of characters of the first chunk, max_chars if None.
 
     Returns:
         List[str]: A list of text chunks.
@@ -75,7 +85,8 @@ def chunk_text(text, max_chars=135):
     sentences = re.split(r"(?<=[;:,.!?])\s+|(?<=[；：，。！？])", text)
 
     for sentence in sentences:
-        if len(current_chunk.encode("utf-8")) + len(sentence.encode("utf-8")) <= max_chars:
+        limit = first_max_chars if first_max_chars is not None and not chunks else max_chars
+        if len(current_chunk.encode("utf-8")) + len(sentence.encode("utf-8")) <= limit:
             current_chunk += sentence + " " if sentence and len(sentence[-1].encode("utf-8")) == 1 else sentence
         else:
             if current_chunk:
@@ -130,9 +141,52 @@ def load_vocoder(vocoder_name="vocos", is_local=False, local_path="", device=dev
     return vocoder
 
 
+# decode mel window by window, for streaming long chunks and bounded vocoder memory
+
+vocoder_context_frames = dict(vocos=32, bigvgan=64)  # not less than receptive field radius, in mel frames
+
+
+class StreamingVocoder:
+    """
+    Decodes mel in fixed windows, each extended with context frames on both sides to cover the vocoder receptive field
+    and cropped back, so the concatenated windows match one full decode up to numerical precision.
+    """
+
+    def __init__(self, vocoder, mel_spec_type=mel_spec_type, window_frames=None, context_frames=None):
+        assert mel_spec_type in vocoder_context_frames, f"Unknown mel_spec_type: {mel_spec_type}"
+        self.vocoder = vocoder
+        self.mel_spec_type = mel_spec_type
+        self.window_frames = window_frames  # None for whole mel at once
+        self.context_frames = context_frames if context_frames is not None else vocoder_context_frames[mel_spec_type]
+
+    def _decode(self, mel):
+        if self.mel_spec_type == "vocos":
+            return self.vocoder.decode(mel)
+        elif self.mel_spec_type == "bigvgan":
+            return self.vocoder(mel)
+
+    def stream(self, mel):
+        """Yields wave of each window in order, mel: (b, d, n), samples along last dim as the vocoder outputs."""
+        n = mel.shape[-1]
+        window_frames = self.window_frames or n
+        for start in range(0, n, window_frames):
+            end = min(start + window_frames, n)
+            left = max(start - self.context_frames, 0)
+            right = min(end + self.context_frames, n)
+            with torch.inference_mode():
+                wave = self._decode(mel[..., left:right])
+                offset = (start - left) * hop_length
+                wave = wave[..., offset : offset + (end - start) * hop_length if end < n else None]
+            yield wave
+
+    def decode(self, mel):
+        return torch.cat(list(self.stream(mel)), dim=-1)
+
+
 # load asr pipeline
 
 asr_pipe = None
+asr_model = "openai/whisper-large-v3-turbo"
 
 
 def initialize_asr_pipeline(device: str = device, dtype=None):
@@ -147,27 +201,147 @@ def initialize_asr_pipeline(device: str = device, dtype=None):
     global asr_pipe
     asr_pipe = pipeline(
         "automatic-speech-recognition",
-        model="openai/whisper-large-v3-turbo",
+        model=asr_model,
         torch_dtype=dtype,
         device=device,
     )
 
 
+# asr transcription cache, on disk so shared by processes and kept across restarts
+
+asr_cache_path = os.environ.get(
+    "F5_TTS_ASR_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "f5_tts", "asr_cache.sqlite")
+)  # "" to disable
+asr_cache_max_bytes = 16 * 1024 * 1024  # of cached text, least recently used evicted beyond
+asr_cache_touch_interval = 60.0  # seconds, last use of an entry recorded at most this often, reads stay lock-free
+
+
+class TranscriptionCache:
+    """
+    Transcriptions keyed by audio content hash, asr model and language, in a sqlite file.
+    Least recently used entries are evicted once total text size exceeds max_bytes. A connection per call, sqlite
+    locking makes it safe for threads and processes sharing the file. Lookups only read, taking the write lock just
+    to record last use if not recorded recently.
+    """
+
+    def __init__(self, path, max_bytes=asr_cache_max_bytes):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        conn = self.connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")  # readers not blocked by a writer
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS transcriptions "
+                "(key TEXT PRIMARY KEY, text TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS transcriptions_last_used ON transcriptions (last_used)")
+        finally:
+            conn.close()
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)  # transactions begun explicitly
+
+    @staticmethod
+    def make_key(audio_hash, model, language=None):
+        return f"{audio_hash}:{model}:{language or ''}"
+
+    def get(self, key):
+        conn = self.connect()
+        try:
+            row = conn.execute("SELECT text, last_used FROM transcriptions WHERE key = ?", (key,)).fetchone()
+            now = time.time()
+            if row is not None and now - row[1] > asr_cache_touch_interval:
+                conn.execute("UPDATE transcriptions SET last_used = ? WHERE key = ?", (now, key))
+        finally:
+            conn.close()
+        return row[0] if row is not None else None
+
+    def put(self, key, text):
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT OR REPLACE INTO transcriptions (key, text, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, text, len(text.encode("utf-8")), time.time()),
+            )
+            # keep most recently used entries within max_bytes
+            conn.execute(
+                "DELETE FROM transcriptions WHERE key IN (SELECT key FROM "
+                "(SELECT key, SUM(size) OVER (ORDER BY last_used DESC, key) AS kept FROM transcriptions) "
+                "WHERE kept > ?)",
+                (self.max_bytes,),
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+
+asr_cache = None
+
+
+def get_asr_cache():
+    global asr_cache
+    if asr_cache is None and asr_cache_path:
+        try:
+            asr_cache = TranscriptionCache(asr_cache_path)
+        except (OSError, sqlite3.Error) as e:
+            print(f"ASR cache unavailable at {asr_cache_path}: {e}")
+    return asr_cache
+
+
+def hash_audio(ref_audio):
+    # content hash of audio file, array or (audio, sr), None if neither
+    if isinstance(ref_audio, str):
+        with open(ref_audio, "rb") as audio_file:
+            return hashlib.md5(audio_file.read()).hexdigest()
+    elif isinstance(ref_audio, tuple):
+        audio, sr = ref_audio
+        return hashlib.md5(f"{sr}:{hash_audio(audio)}".encode()).hexdigest()
+    elif isinstance(ref_audio, torch.Tensor):
+        return hash_audio(ref_audio.detach().cpu().numpy())
+    elif isinstance(ref_audio, np.ndarray):
+        return hashlib.md5(np.ascontiguousarray(ref_audio).tobytes()).hexdigest()
+    return None
+
+
 # transcribe
 
 
-def transcribe(ref_audio, language=None):
+def transcribe(ref_audio, language=None, show_info=None):
+    audio_hash = hash_audio(ref_audio)
+    cache = get_asr_cache() if audio_hash is not None else None
+    if cache is not None:
+        key = TranscriptionCache.make_key(audio_hash, asr_model, language)
+        text = cache.get(key)
+        if text is not None:
+            if show_info is not None:
+                show_info("Using cached reference text...")
+            return text
+
+    if show_info is not None:
+        show_info("No reference text provided, transcribing reference audio...")
+
+    inputs = ref_audio
+    if isinstance(ref_audio, tuple):  # (audio, sr) in memory, pipeline resamples it, no ffmpeg decode
+        audio, sr = ref_audio
+        inputs = {"raw": audio.mean(dim=0).cpu().numpy(), "sampling_rate": sr}
+
     global asr_pipe
     if asr_pipe is None:
         initialize_asr_pipeline(device=device)
-    return asr_pipe(
-        ref_audio,
+    text = asr_pipe(
+        inputs,
         chunk_length_s=30,
         batch_size=128,
         generate_kwargs={"task": "transcribe", "language": language} if language else {"task": "transcribe"},
         return_timestamps=False,
     )["text"].strip()
 
+    if cache is not None:
+        cache.put(key, text)
+    return text
+
 
 # load model checkpoint for inference
 
@@ -261,20 +435,50 @@ def load_model(
     return model
 
 
+def audio_segment_to_array(aseg):
+    # (frames, channels) int pcm as AudioSegment holds
+    return np.array(aseg.get_array_of_samples()).reshape(-1, aseg.channels)
+
+
+def array_to_audio_segment(samples, aseg):
+    # samples back to AudioSegment, same format as aseg they come from
+    return AudioSegment(
+        samples.astype(aseg.array_type).tobytes(),
+        frame_rate=aseg.frame_rate,
+        sample_width=aseg.sample_width,
+        channels=aseg.channels,
+    )
+
+
 def remove_silence_edges(audio, silence_threshold=-42):
-    # Remove silence from the start
-    non_silent_start_idx = silence.detect_leading_silence(audio, silence_threshold=silence_threshold)
-    audio = audio[non_silent_start_idx:]
-
-    # Remove silence from the end
-    non_silent_end_duration = audio.duration_seconds
-    for ms in reversed(audio):
-        if ms.dBFS > silence_threshold:
+    samples = silence.remove_silence_edges(audio_segment_to_array(audio), audio.frame_rate, silence_threshold)
+    return array_to_audio_segment(samples, audio)
+
+
+def decode_audio(path):
+    # (frames, channels) samples and sample rate, decoded in process, ffmpeg (through pydub) only if libsndfile can't
+    try:
+        # int pcm as pydub holds it, same silence thresholds
+        dtype = dict(PCM_24="int32", PCM_32="int32", FLOAT="float32", DOUBLE="float64").get(sf.info(path).subtype)
+        return sf.read(path, dtype=dtype or "int16", always_2d=True)
+    except RuntimeError:  # sf.LibsndfileError, unsupported container or codec
+        aseg = AudioSegment.from_file(path)
+        return audio_segment_to_array(aseg), aseg.frame_rate
+
+
+def clip_on_silence(samples, frame_rate, show_info=print, step=1, **kwargs):
+    # keep non-silent segments, stop at the one going over 15s (if already over 6s)
+    non_silent_segs = silence.split_on_silence(samples, frame_rate, keep_silence=1000, seek_step=10, **kwargs)
+    num_frames = 0
+    for i, non_silent_seg in enumerate(non_silent_segs):
+        if silence.length_ms(num_frames, frame_rate) > 6000 and (
+            silence.length_ms(num_frames + len(non_silent_seg), frame_rate) > 15000
+        ):
+            show_info(f"Audio is over 15s, clipping short. ({step})")
+            non_silent_segs = non_silent_segs[:i]
             break
-        non_silent_end_duration -= 0.001
-    trimmed_audio = audio[: int(non_silent_end_duration * 1000)]
-
-    return trimmed_audio
+        num_frames += len(non_silent_seg)
+    return np.concatenate(non_silent_segs) if non_silent_segs else samples[:0]
 
 
 # preprocess reference audio and text
@@ -282,60 +486,30 @@ def remove_silence_edges(audio, silence_threshold=-42):
 
 def preprocess_ref_audio_text(ref_audio_orig, ref_text, clip_short=True, show_info=print, device=device):
     show_info("Converting audio...")
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
-        aseg = AudioSegment.from_file(ref_audio_orig)
+    samples, sr = decode_audio(ref_audio_orig)
 
-        if clip_short:
-            # 1. try to find long silence for clipping
-            non_silent_segs = silence.split_on_silence(
-                aseg, min_silence_len=1000, silence_thresh=-50, keep_silence=1000, seek_step=10
-            )
-            non_silent_wave = AudioSegment.silent(duration=0)
-            for non_silent_seg in non_silent_segs:
-                if len(non_silent_wave) > 6000 and len(non_silent_wave + non_silent_seg) > 15000:
-                    show_info("Audio is over 15s, clipping short. (1)")
-                    break
-                non_silent_wave += non_silent_seg
-
-            # 2. try to find short silence for clipping if 1. failed
-            if len(non_silent_wave) > 15000:
-                non_silent_segs = silence.split_on_silence(
-                    aseg, min_silence_len=100, silence_thresh=-40, keep_silence=1000, seek_step=10
-                )
-                non_silent_wave = AudioSegment.silent(duration=0)
-                for non_silent_seg in non_silent_segs:
-                    if len(non_silent_wave) > 6000 and len(non_silent_wave + non_silent_seg) > 15000:
-                        show_info("Audio is over 15s, clipping short. (2)")
-                        break
-                    non_silent_wave += non_silent_seg
-
-            aseg = non_silent_wave
+    if clip_short:
+        # 1. try to find long silence for clipping
+        clipped = clip_on_silence(samples, sr, show_info, 1, min_silence_len=1000, silence_thresh=-50)
 
-            # 3. if no proper silence found for clipping
-            if len(aseg) > 15000:
-                aseg = aseg[:15000]
-                show_info("Audio is over 15s, clipping short. (3)")
+        # 2. try to find short silence for clipping if 1. failed
+        if silence.length_ms(len(clipped), sr) > 15000:
+            clipped = clip_on_silence(samples, sr, show_info, 2, min_silence_len=100, silence_thresh=-40)
 
-        aseg = remove_silence_edges(aseg) + AudioSegment.silent(duration=50)
-        aseg.export(f.name, format="wav")
-        ref_audio = f.name
+        # 3. if no proper silence found for clipping
+        samples = clipped
+        if silence.length_ms(len(samples), sr) > 15000:
+            samples = silence.Energy(samples, sr).slice(None, 15000)
+            show_info("Audio is over 15s, clipping short. (3)")
 
-    # Compute a hash of the reference audio file
-    with open(ref_audio, "rb") as audio_file:
-        audio_data = audio_file.read()
-        audio_hash = hashlib.md5(audio_data).hexdigest()
+    samples = silence.remove_silence_edges(samples, sr)
+    samples = np.concatenate([samples, np.zeros((int(sr * 0.05), samples.shape[1]), dtype=samples.dtype)])  # 50ms
+    # (channels, samples) float as torchaudio.load would give, kept in memory
+    ref_audio = (torch.tensor(samples.T / silence.max_amplitude(samples), dtype=torch.float32), sr)
 
     if not ref_text.strip():
-        global _ref_audio_cache
-        if audio_hash in _ref_audio_cache:
-            # Use cached asr transcription
-            show_info("Using cached reference text...")
-            ref_text = _ref_audio_cache[audio_hash]
-        else:
-            show_info("No reference text provided, transcribing reference audio...")
-            ref_text = transcribe(ref_audio)
-            # Cache the transcribed text (not caching custom ref_text, enabling users to do manual tweak)
-            _ref_audio_cache[audio_hash] = ref_text
+        # asr transcription, cached by hash of the reference audio (not caching custom ref_text, enabling manual tweak)
+        ref_text = transcribe(ref_audio, show_info=show_info)
     else:
         show_info("Using custom reference text...")
 
@@ -354,6 +528,35 @@ def preprocess_ref_audio_text(ref_audio_orig, ref_text, clip_short=True, show_in
 # infer process: chunk text -> infer batches [i.e. infer_batch_process()]
 
 
+def load_ref_audio(ref_audio, ref_text):
+    # ref_audio: preprocessed (audio, sr) or file -> (audio, sr), or VoiceProfile as is, with its ref_text
+    if isinstance(ref_audio, str):
+        ref_audio = torchaudio.load(ref_audio)
+    if isinstance(ref_audio, tuple):
+        audio, sr = ref_audio
+        return ref_audio, ref_text, audio.shape[-1] / sr
+    return ref_audio, ref_audio.ref_text, ref_audio.duration
+
+
+def split_gen_text(gen_text, ref_text, ref_duration, first_chunk_duration=None):
+    # chunks fitting in 25s with the reference, at the pace of reference speech, first one short if first_chunk_duration
+    chars_per_second = len(ref_text.encode("utf-8")) / ref_duration
+    max_chars = int(chars_per_second * (25 - ref_duration))
+    first_max_chars = None
+    if first_chunk_duration is not None:
+        first_max_chars = min(int(chars_per_second * first_chunk_duration), max_chars)
+    return chunk_text(gen_text, max_chars=max_chars, first_max_chars=first_max_chars)
+
+
+def get_duration(ref_audio_len, ref_text, gen_text, speed=speed, fix_duration=fix_duration):
+    # total mel frames (reference + generated) to sample for a chunk, ref_text as prepended to it
+    if fix_duration is not None:
+        return int(fix_duration * target_sample_rate / hop_length)
+    ref_text_len = len(ref_text.encode("utf-8"))
+    gen_text_len = len(gen_text.encode("utf-8"))
+    return ref_audio_len + int(ref_audio_len / ref_text_len * gen_text_len / speed)
+
+
 def infer_process(
     ref_audio,
     ref_text,
@@ -365,24 +568,30 @@ def infer_process(
     progress=tqdm,
     target_rms=target_rms,
     cross_fade_duration=cross_fade_duration,
+    cross_fade_curve=cross_fade_curve,
     nfe_step=nfe_step,
     cfg_strength=cfg_strength,
+    cfg_interval=cfg_interval,
+    cfg_decay=cfg_decay,
+    cfg_null_interval=cfg_null_interval,
     sway_sampling_coef=sway_sampling_coef,
+    deep_cache_interval=deep_cache_interval,
     speed=speed,
     fix_duration=fix_duration,
+    batch_chunks=batch_chunks,
     device=device,
+    cancel_token=None,
 ):
     # Split the input text into batches
-    audio, sr = torchaudio.load(ref_audio)
-    max_chars = int(len(ref_text.encode("utf-8")) / (audio.shape[-1] / sr) * (25 - audio.shape[-1] / sr))
-    gen_text_batches = chunk_text(gen_text, max_chars=max_chars)
+    ref_audio, ref_text, ref_duration = load_ref_audio(ref_audio, ref_text)
+    gen_text_batches = split_gen_text(gen_text, ref_text, ref_duration)
     for i, gen_text in enumerate(gen_text_batches):
         print(f"gen_text {i}", gen_text)
     print("\n")
 
     show_info(f"Generating audio in {len(gen_text_batches)} batches...")
     return infer_batch_process(
-        (audio, sr),
+        ref_audio,
         ref_text,
         gen_text_batches,
         model_obj,
@@ -391,129 +600,202 @@ def infer_process(
         progress=progress,
         target_rms=target_rms,
         cross_fade_duration=cross_fade_duration,
+        cross_fade_curve=cross_fade_curve,
         nfe_step=nfe_step,
         cfg_strength=cfg_strength,
+        cfg_interval=cfg_interval,
+        cfg_decay=cfg_decay,
+        cfg_null_interval=cfg_null_interval,
         sway_sampling_coef=sway_sampling_coef,
+        deep_cache_interval=deep_cache_interval,
         speed=speed,
         fix_duration=fix_duration,
+        batch_chunks=batch_chunks,
         device=device,
+        cancel_token=cancel_token,
     )
 
 
+def infer_process_stream(
+    ref_audio,
+    ref_text,
+    gen_text,
+    model_obj,
+    vocoder,
+    first_chunk_duration=2.0,  # seconds, short first chunk for less time to first audio
+    show_info=print,
+    **kwargs,  # see infer_batch_process_stream
+):
+    """
+    Streaming infer_process, yields cross-faded audio (float numpy array at target_sample_rate) chunk by chunk.
+    """
+    # Split the input text into batches, first one short
+    ref_audio, ref_text, ref_duration = load_ref_audio(ref_audio, ref_text)
+    gen_text_batches = split_gen_text(gen_text, ref_text, ref_duration, first_chunk_duration)
+
+    show_info(f"Streaming audio in {len(gen_text_batches)} batches...")
+    yield from infer_batch_process_stream(ref_audio, ref_text, gen_text_batches, model_obj, vocoder, **kwargs)
+
+
 # infer batches
 
 
-def infer_batch_process(
+def infer_chunk_mels(
     ref_audio,
     ref_text,
     gen_text_batches,
     model_obj,
-    vocoder,
-    mel_spec_type="vocos",
     progress=tqdm,
     target_rms=0.1,
-    cross_fade_duration=0.15,
     nfe_step=32,
     cfg_strength=2.0,
+    cfg_interval=None,
+    cfg_decay=None,
+    cfg_null_interval=1,
     sway_sampling_coef=-1,
+    deep_cache_interval=1,
     speed=1,
     fix_duration=None,
+    batch_chunks=False,
     device=None,
+    cancel_token=None,
 ):
-    audio, sr = ref_audio
-    if audio.shape[0] > 1:
-        audio = torch.mean(audio, dim=0, keepdim=True)
-
-    rms = torch.sqrt(torch.mean(torch.square(audio)))
-    if rms < target_rms:
-        audio = audio * target_rms / rms
-    if sr != target_sample_rate:
-        resampler = torchaudio.transforms.Resample(sr, target_sample_rate)
-        audio = resampler(audio)
-    audio = audio.to(device)
-
-    generated_waves = []
-    spectrograms = []
+    """
+    Yields generated mel (1, d, n) of each text chunk, with the gain to bring its wave back to reference loudness.
+    ref_audio is (audio, sr), or a VoiceProfile with reference preprocessed once (ref_text then unused).
+    cancel_token (CancellationToken) is checked between chunks and sampling steps, raises InferenceCancelled.
+    """
+    if isinstance(ref_audio, tuple):
+        audio, sr = ref_audio
+        if audio.shape[0] > 1:
+            audio = torch.mean(audio, dim=0, keepdim=True)
+
+        rms = torch.sqrt(torch.mean(torch.square(audio)))
+        if rms < target_rms:
+            audio = audio * target_rms / rms
+        audio = resample(audio, sr, target_sample_rate)
+        cond = audio.to(device)
+        ref_audio_len = audio.shape[-1] // hop_length
+        profile = None
+    else:
+        profile = ref_audio
+        cond = profile.get_cond(target_rms, device=device)
+        rms = profile.rms
+        ref_text = profile.ref_text
+        ref_audio_len = profile.ref_audio_len
 
     if len(ref_text[-1].encode("utf-8")) == 1:
         ref_text = ref_text + " "
-    for i, gen_text in enumerate(progress.tqdm(gen_text_batches)):
-        # Prepare the text
-        text_list = [ref_text + gen_text]
-        final_text_list = convert_char_to_pinyin(text_list)
 
-        ref_audio_len = audio.shape[-1] // hop_length
-        if fix_duration is not None:
-            duration = int(fix_duration * target_sample_rate / hop_length)
+    # Prepare the text and duration of each chunk
+    final_text_lists = []
+    durations = []
+    for gen_text in gen_text_batches:
+        if profile is None:
+            final_text_lists.append(convert_char_to_pinyin([ref_text + gen_text]))
         else:
-            # Calculate duration
-            ref_text_len = len(ref_text.encode("utf-8"))
-            gen_text_len = len(gen_text.encode("utf-8"))
-            duration = ref_audio_len + int(ref_audio_len / ref_text_len * gen_text_len / speed)
+            final_text_lists.append([profile.get_text(gen_text)])
 
-        # inference
+        durations.append(get_duration(ref_audio_len, ref_text, gen_text, speed, fix_duration))
+
+    sample_kwargs = dict(
+        steps=nfe_step,
+        cfg_strength=cfg_strength,
+        cfg_interval=cfg_interval,
+        cfg_decay=cfg_decay,
+        cfg_null_interval=cfg_null_interval,
+        sway_sampling_coef=sway_sampling_coef,
+        deep_cache_interval=deep_cache_interval,
+        cancel_token=cancel_token,
+    )
+
+    # chunks share the reference audio, sample them all at once as a padded batch with per chunk duration
+    if batch_chunks and len(gen_text_batches) > 1:
         with torch.inference_mode():
+            if cond.ndim == 2:
+                cond = model_obj.mel_spec(cond).permute(0, 2, 1)
+            # same duration as sample() would extend to, so each chunk is cut where it ends
+            durations = [
+                max(duration, cond.shape[1] + 1, len(final_text_list[0]) + 1)
+                for duration, final_text_list in zip(durations, final_text_lists)
+            ]
             generated, _ = model_obj.sample(
-                cond=audio,
-                text=final_text_list,
-                duration=duration,
-                steps=nfe_step,
-                cfg_strength=cfg_strength,
-                sway_sampling_coef=sway_sampling_coef,
+                cond=cond.expand(len(durations), -1, -1),
+                text=[final_text_list[0] for final_text_list in final_text_lists],
+                duration=torch.tensor(durations, device=cond.device),
+                **sample_kwargs,
             )
+        batch_generated = [generated[i : i + 1, :duration] for i, duration in enumerate(durations)]
+
+    for i, gen_text in enumerate(progress.tqdm(gen_text_batches)):
+        if cancel_token is not None:
+            cancel_token.check()
+
+        # inference
+        with torch.inference_mode():
+            if batch_chunks and len(gen_text_batches) > 1:
+                generated = batch_generated[i]
+            else:
+                generated, _ = model_obj.sample(
+                    cond=cond,
+                    text=final_text_lists[i],
+                    duration=durations[i],
+                    **sample_kwargs,
+                )
 
             generated = generated.to(torch.float32)
             generated = generated[:, ref_audio_len:, :]
             generated_mel_spec = generated.permute(0, 2, 1)
-            if mel_spec_type == "vocos":
-                generated_wave = vocoder.decode(generated_mel_spec)
-            elif mel_spec_type == "bigvgan":
-                generated_wave = vocoder(generated_mel_spec)
-            if rms < target_rms:
-                generated_wave = generated_wave * rms / target_rms
+
+        # hand over each chunk once sampled, outside inference mode
+        yield generated_mel_spec, rms / target_rms if rms < target_rms else None
+
+
+def infer_chunk_waves(
+    ref_audio,
+    ref_text,
+    gen_text_batches,
+    model_obj,
+    vocoder,
+    mel_spec_type="vocos",
+    vocoder_window_frames=None,  # decode in windows of mel frames to bound vocoder memory, None for whole chunk
+    **kwargs,  # see infer_chunk_mels
+):
+    streaming_vocoder = StreamingVocoder(vocoder, mel_spec_type, window_frames=vocoder_window_frames)
+    for generated_mel_spec, gain in infer_chunk_mels(ref_audio, ref_text, gen_text_batches, model_obj, **kwargs):
+        with torch.inference_mode():
+            generated_wave = streaming_vocoder.decode(generated_mel_spec)
+            if gain is not None:
+                generated_wave = generated_wave * gain
 
             # wav -> numpy
             generated_wave = generated_wave.squeeze().cpu().numpy()
+            spectrogram = generated_mel_spec[0].cpu().numpy()
 
-            generated_waves.append(generated_wave)
-            spectrograms.append(generated_mel_spec[0].cpu().numpy())
+        # hand over each chunk once vocoded, outside inference mode
+        yield generated_wave, spectrogram
 
-    # Combine all generated waves with cross-fading
-    if cross_fade_duration <= 0:
-        # Simply concatenate
-        final_wave = np.concatenate(generated_waves)
-    else:
-        final_wave = generated_waves[0]
-        for i in range(1, len(generated_waves)):
-            prev_wave = final_wave
-            next_wave = generated_waves[i]
-
-            # Calculate cross-fade samples, ensuring it does not exceed wave lengths
-            cross_fade_samples = int(cross_fade_duration * target_sample_rate)
-            cross_fade_samples = min(cross_fade_samples, len(prev_wave), len(next_wave))
-
-            if cross_fade_samples <= 0:
-                # No overlap possible, concatenate
-                final_wave = np.concatenate([prev_wave, next_wave])
-                continue
-
-            # Overlapping parts
-            prev_overlap = prev_wave[-cross_fade_samples:]
-            next_overlap = next_wave[:cross_fade_samples]
-
-            # Fade out and fade in
-            fade_out = np.linspace(1, 0, cross_fade_samples)
-            fade_in = np.linspace(0, 1, cross_fade_samples)
-
-            # Cross-faded overlap
-            cross_faded_overlap = prev_overlap * fade_out + next_overlap * fade_in
-
-            # Combine
-            new_wave = np.concatenate(
-                [prev_wave[:-cross_fade_samples], cross_faded_overlap, next_wave[cross_fade_samples:]]
-            )
 
-            final_wave = new_wave
+def infer_batch_process(
+    ref_audio,
+    ref_text,
+    gen_text_batches,
+    model_obj,
+    vocoder,
+    cross_fade_duration=0.15,
+    cross_fade_curve=cross_fade_curve,
+    **kwargs,  # see infer_chunk_waves
+):
+    generated_waves = []
+    spectrograms = []
+    for generated_wave, spectrogram in infer_chunk_waves(
+        ref_audio, ref_text, gen_text_batches, model_obj, vocoder, **kwargs
+    ):
+        generated_waves.append(generated_wave)
+        spectrograms.append(spectrogram)
+
+    # Combine all generated waves with cross-fading
+    final_wave = cross_fade_waves(generated_waves, cross_fade_duration, cross_fade_curve)
 
     # Create a combined spectrogram
     combined_spectrogram = np.concatenate(spectrograms, axis=1)
@@ -521,19 +803,146 @@ def infer_batch_process(
     return final_wave, target_sample_rate, combined_spectrogram
 
 
+def infer_batch_process_stream(
+    ref_audio,
+    ref_text,
+    gen_text_batches,
+    model_obj,
+    vocoder,
+    mel_spec_type="vocos",
+    vocoder_window_frames=None,  # vocode in windows of mel frames and yield each, None for whole chunk at once
+    cross_fade_duration=0.15,
+    cross_fade_curve=cross_fade_curve,
+    **kwargs,  # see infer_chunk_mels, batch_chunks not for streaming
+):
+    """
+    Yields cross-faded audio (float numpy array at target_sample_rate) piece by piece, as soon as each chunk, or
+    window of it, is vocoded. Tail of a chunk is held back to cross-fade with the next one, all yielded pieces
+    concatenated equal to the wave infer_batch_process returns.
+    """
+    assert not kwargs.get("batch_chunks"), "batch_chunks generates all chunks at once, no use for streaming"
+    streaming_vocoder = StreamingVocoder(vocoder, mel_spec_type, window_frames=vocoder_window_frames)
+    cross_fader = CrossFader(cross_fade_duration, cross_fade_curve)
+    for generated_mel_spec, gain in infer_chunk_mels(ref_audio, ref_text, gen_text_batches, model_obj, **kwargs):
+        # chunk length is known from its mel, so where it overlaps the held tail is too
+        cross_fader.start(generated_mel_spec.shape[-1] * hop_length)
+        for generated_wave in streaming_vocoder.stream(generated_mel_spec):
+            if gain is not None:
+                generated_wave = generated_wave * gain
+            piece = cross_fader.write(generated_wave.squeeze().cpu().numpy())
+            if len(piece) > 0:
+                yield piece
+
+    tail = cross_fader.flush()
+    if len(tail) > 0:
+        yield tail
+
+
+# combine waves with cross-fading
+
+
+@lru_cache(maxsize=16)
+def get_fade_curves(samples, curve="linear"):
+    # (fade_out, fade_in) of length samples, shared read-only
+    if curve == "linear":
+        fade_out, fade_in = np.linspace(1, 0, samples), np.linspace(0, 1, samples)
+    elif curve == "equal_power":
+        t = np.linspace(0, np.pi / 2, samples)
+        fade_out, fade_in = np.cos(t), np.sin(t)
+    else:
+        raise ValueError(f"Unknown cross-fade curve: {curve}")
+    fade_out.setflags(write=False)
+    fade_in.setflags(write=False)
+    return fade_out, fade_in
+
+
+class CrossFader:
+    """
+    Cross-fades waves one after another, each overlapping the wave so far by up to cross_fade_duration.
+    assemble() joins all at once into one preallocated buffer. Or incrementally, with the length of each wave known
+    before its samples (e.g. from its mel): start(num_samples), then write() its samples piece by piece, each returning
+    the samples final by then; the tail to overlap with the next wave is held back until flush().
+    """
+
+    def __init__(self, cross_fade_duration=cross_fade_duration, curve=cross_fade_curve, dtype=np.float32):
+        self.cross_fade_samples = max(int(cross_fade_duration * target_sample_rate), 0)
+        self.curve = curve
+        self.dtype = dtype
+        self.tail = np.zeros(0, dtype=dtype)  # end of waves so far, not returned yet
+        self.length = 0  # samples of waves so far, returned or not
+
+    def overlaps(self, lengths, held=0):
+        # overlap of each wave with all before it (held samples before the first)
+        overlaps = []
+        for length in lengths:
+            overlaps.append(min(self.cross_fade_samples, held, length))
+            held += length - overlaps[-1]
+        return overlaps, held
+
+    def blend(self, out, start, wave, overlap, offset=0):
+        # write wave[offset:] from out[start + offset], its first overlap samples cross-faded with what out holds
+        end = max(min(overlap - offset, len(wave)), 0)
+        if end > 0:
+            fade_out, fade_in = get_fade_curves(overlap, self.curve)
+            region = slice(start + offset, start + offset + end)
+            out[region] = out[region] * fade_out[offset : offset + end] + wave[:end] * fade_in[offset : offset + end]
+        out[start + offset + end : start + offset + len(wave)] = wave[end:]
+
+    def assemble(self, waves):
+        overlaps, total = self.overlaps([len(wave) for wave in waves])
+        out = np.empty(total, dtype=self.dtype)
+        start = 0
+        for wave, overlap in zip(waves, overlaps):
+            start -= overlap
+            self.blend(out, start, wave, overlap)
+            start += len(wave)
+        return out
+
+    def start(self, num_samples):
+        # overlap clamped against the whole wave so far as assemble() does, so waves shorter than the fade stream
+        # the same as assembled (the held tail is all of the wave so far until it grows past the fade)
+        (self.overlap,), self.length = self.overlaps([num_samples], held=self.length)
+        total = len(self.tail) + num_samples - self.overlap
+        self.hold = min(self.cross_fade_samples, total)  # tail kept for the next wave
+        self.buffer = np.empty(total, dtype=self.dtype)
+        self.buffer[: len(self.tail)] = self.tail
+        self.wave_start = len(self.tail) - self.overlap
+        self.written = self.returned = 0
+
+    def write(self, samples):
+        self.blend(self.buffer, self.wave_start, samples, self.overlap, offset=self.written)
+        self.written += len(samples)
+        ready = min(self.wave_start + self.written, len(self.buffer) - self.hold)
+        piece = self.buffer[self.returned : ready]
+        self.returned = max(self.returned, ready)
+        if self.wave_start + self.written >= len(self.buffer):
+            self.tail = self.buffer[self.returned :].copy()
+        return piece
+
+    def add(self, wave):
+        self.start(len(wave))
+        return self.write(wave)
+
+    def flush(self):
+        tail, self.tail = self.tail, np.zeros(0, dtype=self.dtype)
+        self.length = 0
+        return tail
+
+
+def cross_fade_waves(generated_waves, cross_fade_duration=0.15, curve=cross_fade_curve):
+    return CrossFader(cross_fade_duration, curve).assemble(generated_waves)
+
+
 # remove silence from generated wav
 
 
 def remove_silence_for_generated_wav(filename):
-    aseg = AudioSegment.from_file(filename)
+    samples, sr = decode_audio(filename)
     non_silent_segs = silence.split_on_silence(
-        aseg, min_silence_len=1000, silence_thresh=-50, keep_silence=500, seek_step=10
+        samples, sr, min_silence_len=1000, silence_thresh=-50, keep_silence=500, seek_step=10
     )
-    non_silent_wave = AudioSegment.silent(duration=0)
-    for non_silent_seg in non_silent_segs:
-        non_silent_wave += non_silent_seg
-    aseg = non_silent_wave
-    aseg.export(filename, format="wav")
+    samples = np.concatenate(non_silent_segs) if non_silent_segs else samples[:0]
+    sf.write(filename, samples, sr)
 
 
 # save spectrogram
@@ -0,0 +1,187 @@
+# Voice profiles, reference audio & text preprocessed once and kept on disk, reused by any number of requests
+# a profile holds the trimmed reference wave, its mel, loudness and the tokens of the reference text
+
+import json
+import os
+import re
+import threading
+
+import torch
+from safetensors import safe_open
+from safetensors.torch import load_file, save_file
+
+from f5_tts.infer.utils_infer import (
+    device,
+    hop_length,
+    mel_spec_type,
+    n_fft,
+    n_mel_channels,
+    preprocess_ref_audio_text,
+    target_rms,
+    target_sample_rate,
+    win_length,
+)
+from f5_tts.model.modules import MelSpec, resample
+from f5_tts.model.utils import convert_char_to_pinyin
+
+
+class VoiceProfile:
+    def __init__(
+        self, name, audio, rms, ref_text, ref_tokens, mel=None, mel_spec_type=mel_spec_type, target_rms=target_rms
+    ):
+        self.name = name
+        self.audio = audio  # (1, samples) at target_sample_rate, trimmed, original loudness
+        self.rms = rms  # of reference, generated wave is scaled back to it if quieter than target_rms
+        self.ref_text = ref_text  # as preprocess_ref_audio_text returns
+        self.ref_tokens = ref_tokens  # convert_char_to_pinyin of ref_text as prepended to each text chunk
+        self.mel_spec_type = mel_spec_type
+        self.target_rms = target_rms
+        self.mel = mel if mel is not None else self.get_mel()  # (1, n, d) of audio at target_rms
+
+    @property
+    def duration(self):
+        return self.audio.shape[-1] / target_sample_rate
+
+    @property
+    def ref_audio_len(self):
+        return self.audio.shape[-1] // hop_length
+
+    def get_audio(self, target_rms=target_rms):
+        if self.rms < target_rms:
+            return self.audio * target_rms / self.rms
+        return self.audio
+
+    def get_mel(self):
+        mel_spec = MelSpec(
+            n_fft=n_fft,
+            hop_length=hop_length,
+            win_length=win_length,
+            n_mel_channels=n_mel_channels,
+            target_sample_rate=target_sample_rate,
+            mel_spec_type=self.mel_spec_type,
+        )
+        with torch.no_grad():
+            return mel_spec(self.get_audio(self.target_rms)).permute(0, 2, 1).contiguous()
+
+    def get_cond(self, target_rms=target_rms, device=device):
+        """Precomputed mel as sampling cond, or the wave for sample() to extract mel from if loudness differs."""
+        if target_rms == self.target_rms:
+            return self.mel.to(device)
+        return self.get_audio(target_rms).to(device)
+
+    def get_text(self, gen_text):
+        """Tokens of ref_text + gen_text, only gen_text converted."""
+        # prepended ref_text ends with a space or "。", its own jieba segment, so reference tokens stay the same as
+        # converted together, converting gen_text after that last char keeps the spacing rule at the boundary
+        last_char = " " if len(self.ref_text[-1].encode("utf-8")) == 1 else self.ref_text[-1]
+        return self.ref_tokens + convert_char_to_pinyin([last_char + gen_text])[0][1:]
+
+    @classmethod
+    def from_audio(
+        cls,
+        name,
+        ref_audio_orig,
+        ref_text="",
+        mel_spec_type=mel_spec_type,
+        target_rms=target_rms,
+        clip_short=True,
+        show_info=print,
+        device=device,
+    ):
+        """Preprocess a reference audio file (and transcribe it if ref_text is empty) into a profile."""
+        (audio, sr), ref_text = preprocess_ref_audio_text(
+            ref_audio_orig, ref_text, clip_short=clip_short, show_info=show_info, device=device
+        )
+
+        if audio.shape[0] > 1:
+            audio = torch.mean(audio, dim=0, keepdim=True)
+        rms = torch.sqrt(torch.mean(torch.square(audio))).item()
+        audio = resample(audio, sr, target_sample_rate)
+
+        ref_tokens = convert_char_to_pinyin([ref_text + " " if len(ref_text[-1].encode("utf-8")) == 1 else ref_text])[0]
+
+        return cls(name, audio, rms, ref_text, ref_tokens, mel_spec_type=mel_spec_type, target_rms=target_rms)
+
+    def save(self, path):
+        metadata = dict(
+            name=self.name,
+            rms=repr(self.rms),
+            ref_text=self.ref_text,
+            ref_tokens=json.dumps(self.ref_tokens, ensure_ascii=False),
+            mel_spec_type=self.mel_spec_type,
+            target_rms=repr(self.target_rms),
+        )
+        save_file(dict(audio=self.audio.contiguous(), mel=self.mel.contiguous()), path, metadata=metadata)
+
+    @classmethod
+    def load(cls, path, mel_spec_type=mel_spec_type):
+        """Load a saved profile, mel recomputed if saved for the other vocoder."""
+        with safe_open(path, framework="pt") as f:
+            metadata = f.metadata()
+        tensors = load_file(path)
+        return cls(
+            metadata["name"],
+            tensors["audio"],
+            float(metadata["rms"]),
+            metadata["ref_text"],
+            json.loads(metadata["ref_tokens"]),
+            mel=tensors["mel"] if metadata["mel_spec_type"] == mel_spec_type else None,
+            mel_spec_type=mel_spec_type,
+            target_rms=float(metadata["target_rms"]),
+        )
+
+
+class VoiceRegistry:
+    """
+    Voice profiles saved as <root>/<name>.safetensors, each loaded once on first use and kept in memory.
+    Safe to share between threads.
+    """
+
+    def __init__(self, root, mel_spec_type=mel_spec_type):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.mel_spec_type = mel_spec_type
+        self.profiles = {}
+        self.lock = threading.Lock()
+
+    def path(self, name):
+        # names may come from clients, only plain file names under root
+        if not isinstance(name, str) or not re.fullmatch(r"[\w.-]+", name) or name.startswith("."):
+            raise ValueError(f"Invalid voice name {name!r}, letters, digits, _ . - only")
+        path = os.path.join(self.root, f"{name}.safetensors")
+        root = os.path.abspath(self.root)
+        if os.path.commonpath([root, os.path.abspath(path)]) != root:
+            raise ValueError(f"Invalid voice name {name!r}")
+        return path
+
+    def names(self):
+        saved = [file[: -len(".safetensors")] for file in os.listdir(self.root) if file.endswith(".safetensors")]
+        return sorted(set(saved) | set(self.profiles))
+
+    def __contains__(self, name):
+        try:
+            return name in self.profiles or os.path.isfile(self.path(name))
+        except ValueError:
+            return False
+
+    def get(self, name) -> VoiceProfile:
+        with self.lock:
+            if name not in self.profiles:
+                if not os.path.isfile(self.path(name)):
+                    raise KeyError(f"Voice {name} not found in {self.root}, choose from {self.names()}")
+                self.profiles[name] = VoiceProfile.load(self.path(name), mel_spec_type=self.mel_spec_type)
+            return self.profiles[name]
+
+    def add(self, name, ref_audio_orig, ref_text="", **kwargs) -> VoiceProfile:
+        """Create a profile from reference audio (see VoiceProfile.from_audio) and save it, replacing any same name."""
+        profile = VoiceProfile.from_audio(name, ref_audio_orig, ref_text, mel_spec_type=self.mel_spec_type, **kwargs)
+        with self.lock:
+            profile.save(self.path(name))
+            self.profiles[name] = profile
+        return profile
+
+    def remove(self, name):
+        with self.lock:
+            self.profiles.pop(name, None)
+            if os.path.isfile(self.path(name)):
+                os.remove(self.path(name))
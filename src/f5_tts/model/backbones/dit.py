@@ -50,7 +50,9 @@ class TextEmbedding(nn.Module):
         batch, text_len = text.shape[0], text.shape[1]
         text = F.pad(text, (0, seq_len - text_len), value=0)
 
-        if drop_text:  # cfg for text
+        if isinstance(drop_text, torch.Tensor):  # per-sample cfg for text, e.g. fused cond & uncond batch
+            text = text.masked_fill(drop_text[:, None], 0)
+        elif drop_text:  # cfg for text
             text = torch.zeros_like(text)
 
         text = self.text_embed(text)  # b n -> b n d
@@ -75,17 +77,40 @@ class TextEmbedding(nn.Module):
 class InputEmbedding(nn.Module):
     def __init__(self, mel_dim, text_dim, out_dim):
         super().__init__()
+        self.mel_dim = mel_dim
         self.proj = nn.Linear(mel_dim * 2 + text_dim, out_dim)
         self.conv_pos_embed = ConvPositionEmbedding(dim=out_dim)
 
-    def forward(self, x: float["b n d"], cond: float["b n d"], text_embed: float["b n d"], drop_audio_cond=False):  # noqa: F722
-        if drop_audio_cond:  # cfg for cond audio
-            cond = torch.zeros_like(cond)
+    def forward(
+        self,
+        x: float["b n d"],  # noqa: F722
+        cond: float["b n d"] | None,  # noqa: F722
+        text_embed: float["b n d"] | None,  # noqa: F722
+        drop_audio_cond=False,
+        cond_embed: float["b n d"] | None = None,  # noqa: F722
+    ):
+        if cond_embed is not None:  # step-invariant cond & text part of proj already computed, see embed_cond()
+            x = F.linear(x, self.proj.weight[:, : self.mel_dim]) + cond_embed
+        else:
+            if isinstance(drop_audio_cond, torch.Tensor):  # per-sample cfg for cond audio
+                cond = cond.masked_fill(drop_audio_cond[:, None, None], 0.0)
+            elif drop_audio_cond:  # cfg for cond audio
+                cond = torch.zeros_like(cond)
+
+            x = self.proj(torch.cat((x, cond, text_embed), dim=-1))
 
-        x = self.proj(torch.cat((x, cond, text_embed), dim=-1))
         x = self.conv_pos_embed(x) + x
         return x
 
+    def embed_cond(self, cond: float["b n d"], text_embed: float["b n d"], drop_audio_cond=False):  # noqa: F722
+        # cond & text slice of proj (with bias), fixed across ode steps during sampling
+        if isinstance(drop_audio_cond, torch.Tensor):
+            cond = cond.masked_fill(drop_audio_cond[:, None, None], 0.0)
+        elif drop_audio_cond:
+            cond = torch.zeros_like(cond)
+
+        return F.linear(torch.cat((cond, text_embed), dim=-1), self.proj.weight[:, self.mel_dim :], self.proj.bias)
+
 
 # Transformer backbone using DiT blocks
 
@@ -127,37 +152,86 @@ class DiT(nn.Module):
         self.norm_out = AdaLayerNormZero_Final(dim)  # final modulation
         self.proj_out = nn.Linear(dim, mel_dim)
 
+    def get_context(
+        self,
+        cond: float["b n d"],  # masked cond audio  # noqa: F722
+        text: int["b nt"],  # text  # noqa: F722
+        drop_audio_cond=False,  # cfg for cond audio, bool or bool["b"] per sample
+        drop_text=False,  # cfg for text, bool or bool["b"] per sample
+    ):
+        # text embedding and cond part of input projection do not change across ode steps, compute once per sampling
+        text_embed = self.text_embed(text, cond.shape[1], drop_text=drop_text)
+        return self.input_embed.embed_cond(cond, text_embed, drop_audio_cond=drop_audio_cond)
+
+    def get_time_modulation(self, time: float["s"]):  # time steps of a whole sampling schedule  # noqa: F821
+        # time embedding & adaln modulation of all blocks only depend on time, one batched matmul per block
+        t = self.time_embed(time)
+        block_modulation = torch.stack([block.attn_norm.get_modulation(t) for block in self.transformer_blocks], dim=1)
+        return block_modulation, self.norm_out.get_modulation(t)  # s depth 6d, s 2d
+
     def forward(
         self,
         x: float["b n d"],  # nosied input audio  # noqa: F722
         cond: float["b n d"],  # masked cond audio  # noqa: F722
         text: int["b nt"],  # text  # noqa: F722
         time: float["b"] | float[""],  # time step  # noqa: F821 F722
-        drop_audio_cond,  # cfg for cond audio
-        drop_text,  # cfg for text
+        drop_audio_cond,  # cfg for cond audio, bool or bool["b"] per sample
+        drop_text,  # cfg for text, bool or bool["b"] per sample
         mask: bool["b n"] | None = None,  # noqa: F722
+        context: float["b n d"] | None = None,  # from get_context(), then cond, text & drop flags unused  # noqa: F722
+        time_modulation: tuple | None = None,  # one step of get_time_modulation(), then time unused
+        deep_cache: dict | None = None,  # dict(layers=k), residual of middle blocks kept here, see below
+        reuse_deep_cache=False,  # only run first & last k blocks, add cached residual of middle blocks
     ):
         batch, seq_len = x.shape[0], x.shape[1]
         if time.ndim == 0:
             time = time.repeat(batch)
 
         # t: conditioning time, c: context (text + masked cond audio), x: noised input audio
-        t = self.time_embed(time)
-        text_embed = self.text_embed(text, seq_len, drop_text=drop_text)
-        x = self.input_embed(x, cond, text_embed, drop_audio_cond=drop_audio_cond)
+        if time_modulation is not None:
+            t = None
+            block_modulation, final_modulation = time_modulation
+        else:
+            t = self.time_embed(time)
+            final_modulation = None
+        if context is not None:
+            x = self.input_embed(x, None, None, cond_embed=context)
+        else:
+            text_embed = self.text_embed(text, seq_len, drop_text=drop_text)
+            x = self.input_embed(x, cond, text_embed, drop_audio_cond=drop_audio_cond)
 
         rope = self.rotary_embed.forward_from_seq_len(seq_len)
 
         if self.long_skip_connection is not None:
             residual = x
 
-        for block in self.transformer_blocks:
-            x = block(x, t, mask=mask, rope=rope)
+        # deepcache (https://arxiv.org/abs/2312.00858), features of deep blocks change slowly across ode steps
+        # full steps store what middle blocks add to hidden states, cheap steps reuse it and skip these blocks
+        if deep_cache is not None:
+            assert 0 < deep_cache["layers"] <= self.depth // 2, "deep cache layers should be in [1, depth // 2]"
+            assert not reuse_deep_cache or "residual" in deep_cache, "deep cache is empty, run a full step first"
+            cache_start, cache_end = deep_cache["layers"], self.depth - deep_cache["layers"]
+        else:
+            cache_start = cache_end = self.depth
+
+        for i, block in enumerate(self.transformer_blocks):
+            if i == cache_start:
+                if reuse_deep_cache:
+                    x = x + deep_cache["residual"]
+                else:
+                    cache_in = x
+            if i == cache_end and not reuse_deep_cache:
+                deep_cache["residual"] = x - cache_in
+            if reuse_deep_cache and cache_start <= i < cache_end:
+                continue
+
+            modulation = block_modulation[:, i] if time_modulation is not None else None
+            x = block(x, t, mask=mask, rope=rope, modulation=modulation)
 
         if self.long_skip_connection is not None:
             x = self.long_skip_connection(torch.cat((x, residual), dim=-1))
 
-        x = self.norm_out(x, t)
+        x = self.norm_out(x, t, modulation=final_modulation)
         output = self.proj_out(x)
 
         return output
@@ -10,6 +10,7 @@ d - dimension
 from __future__ import annotations
 
 import torch
+import torch.nn.functional as F
 from torch import nn
 
 from x_transformers.x_transformers import RotaryEmbedding
@@ -37,7 +38,9 @@ class TextEmbedding(nn.Module):
 
     def forward(self, text: int["b nt"], drop_text=False) -> int["b nt d"]:  # noqa: F722
         text = text + 1
-        if drop_text:
+        if isinstance(drop_text, torch.Tensor):  # per-sample cfg for text
+            text = text.masked_fill(drop_text[:, None], 0)
+        elif drop_text:
             text = torch.zeros_like(text)
         text = self.text_embed(text)
 
@@ -58,17 +61,37 @@ class TextEmbedding(nn.Module):
 class AudioEmbedding(nn.Module):
     def __init__(self, in_dim, out_dim):
         super().__init__()
+        self.in_dim = in_dim
         self.linear = nn.Linear(2 * in_dim, out_dim)
         self.conv_pos_embed = ConvPositionEmbedding(out_dim)
 
-    def forward(self, x: float["b n d"], cond: float["b n d"], drop_audio_cond=False):  # noqa: F722
-        if drop_audio_cond:
-            cond = torch.zeros_like(cond)
-        x = torch.cat((x, cond), dim=-1)
-        x = self.linear(x)
+    def forward(
+        self,
+        x: float["b n d"],  # noqa: F722
+        cond: float["b n d"] | None,  # noqa: F722
+        drop_audio_cond=False,
+        cond_embed: float["b n d"] | None = None,  # noqa: F722
+    ):
+        if cond_embed is not None:  # step-invariant cond part of linear already computed, see embed_cond()
+            x = F.linear(x, self.linear.weight[:, : self.in_dim]) + cond_embed
+        else:
+            if isinstance(drop_audio_cond, torch.Tensor):  # per-sample cfg for cond audio
+                cond = cond.masked_fill(drop_audio_cond[:, None, None], 0.0)
+            elif drop_audio_cond:
+                cond = torch.zeros_like(cond)
+            x = torch.cat((x, cond), dim=-1)
+            x = self.linear(x)
         x = self.conv_pos_embed(x) + x
         return x
 
+    def embed_cond(self, cond: float["b n d"], drop_audio_cond=False):  # noqa: F722
+        # cond slice of linear (with bias), fixed across ode steps during sampling
+        if isinstance(drop_audio_cond, torch.Tensor):
+            cond = cond.masked_fill(drop_audio_cond[:, None, None], 0.0)
+        elif drop_audio_cond:
+            cond = torch.zeros_like(cond)
+        return F.linear(cond, self.linear.weight[:, self.in_dim :], self.linear.bias)
+
 
 # Transformer backbone using MM-DiT blocks
 
@@ -113,34 +136,73 @@ class MMDiT(nn.Module):
         self.norm_out = AdaLayerNormZero_Final(dim)  # final modulation
         self.proj_out = nn.Linear(dim, mel_dim)
 
+    def get_context(
+        self,
+        cond: float["b n d"],  # masked cond audio  # noqa: F722
+        text: int["b nt"],  # text  # noqa: F722
+        drop_audio_cond=False,  # cfg for cond audio, bool or bool["b"] per sample
+        drop_text=False,  # cfg for text, bool or bool["b"] per sample
+    ):
+        # text embedding and cond part of audio embedding do not change across ode steps, compute once per sampling
+        c = self.text_embed(text, drop_text=drop_text)
+        cond_embed = self.audio_embed.embed_cond(cond, drop_audio_cond=drop_audio_cond)
+        return c, cond_embed
+
+    def get_time_modulation(self, time: float["s"]):  # time steps of a whole sampling schedule  # noqa: F821
+        # time embedding & adaln modulation of all blocks only depend on time, one batched matmul per block
+        t = self.time_embed(time)
+        c_modulation = [block.attn_norm_c.get_modulation(t) for block in self.transformer_blocks]
+        x_modulation = torch.stack([block.attn_norm_x.get_modulation(t) for block in self.transformer_blocks], dim=1)
+        return (
+            torch.stack(c_modulation[:-1], dim=1),  # s depth-1 6d
+            c_modulation[-1],  # s 2d, last block is context_pre_only
+            x_modulation,  # s depth 6d
+            self.norm_out.get_modulation(t),  # s 2d
+        )
+
     def forward(
         self,
         x: float["b n d"],  # nosied input audio  # noqa: F722
         cond: float["b n d"],  # masked cond audio  # noqa: F722
         text: int["b nt"],  # text  # noqa: F722
         time: float["b"] | float[""],  # time step  # noqa: F821 F722
-        drop_audio_cond,  # cfg for cond audio
-        drop_text,  # cfg for text
+        drop_audio_cond,  # cfg for cond audio, bool or bool["b"] per sample
+        drop_text,  # cfg for text, bool or bool["b"] per sample
         mask: bool["b n"] | None = None,  # noqa: F722
+        context: tuple | None = None,  # from get_context(), then cond, text & drop flags unused
+        time_modulation: tuple | None = None,  # one step of get_time_modulation(), then time unused
     ):
         batch = x.shape[0]
         if time.ndim == 0:
             time = time.repeat(batch)
 
         # t: conditioning (time), c: context (text + masked cond audio), x: noised input audio
-        t = self.time_embed(time)
-        c = self.text_embed(text, drop_text=drop_text)
-        x = self.audio_embed(x, cond, drop_audio_cond=drop_audio_cond)
+        if time_modulation is not None:
+            t = None
+            c_modulation, last_c_modulation, x_modulation, final_modulation = time_modulation
+        else:
+            t = self.time_embed(time)
+            final_modulation = None
+        if context is not None:
+            c, cond_embed = context
+            x = self.audio_embed(x, None, cond_embed=cond_embed)
+        else:
+            c = self.text_embed(text, drop_text=drop_text)
+            x = self.audio_embed(x, cond, drop_audio_cond=drop_audio_cond)
 
         seq_len = x.shape[1]
-        text_len = text.shape[1]
+        text_len = c.shape[1]
         rope_audio = self.rotary_embed.forward_from_seq_len(seq_len)
         rope_text = self.rotary_embed.forward_from_seq_len(text_len)
 
-        for block in self.transformer_blocks:
-            c, x = block(x, c, t, mask=mask, rope=rope_audio, c_rope=rope_text)
+        for i, block in enumerate(self.transformer_blocks):
+            if time_modulation is not None:
+                modulation = (c_modulation[:, i] if i < self.depth - 1 else last_c_modulation, x_modulation[:, i])
+            else:
+                modulation = None
+            c, x = block(x, c, t, mask=mask, rope=rope_audio, c_rope=rope_text, modulation=modulation)
 
-        x = self.norm_out(x, t)
+        x = self.norm_out(x, t, modulation=final_modulation)
         output = self.proj_out(x)
 
         return output
@@ -53,7 +53,9 @@ class TextEmbedding(nn.Module):
         batch, text_len = text.shape[0], text.shape[1]
         text = F.pad(text, (0, seq_len - text_len), value=0)
 
-        if drop_text:  # cfg for text
+        if isinstance(drop_text, torch.Tensor):  # per-sample cfg for text, e.g. fused cond & uncond batch
+            text = text.masked_fill(drop_text[:, None], 0)
+        elif drop_text:  # cfg for text
             text = torch.zeros_like(text)
 
         text = self.text_embed(text)  # b n -> b n d
@@ -78,17 +80,40 @@ class TextEmbedding(nn.Module):
 class InputEmbedding(nn.Module):
     def __init__(self, mel_dim, text_dim, out_dim):
         super().__init__()
+        self.mel_dim = mel_dim
         self.proj = nn.Linear(mel_dim * 2 + text_dim, out_dim)
         self.conv_pos_embed = ConvPositionEmbedding(dim=out_dim)
 
-    def forward(self, x: float["b n d"], cond: float["b n d"], text_embed: float["b n d"], drop_audio_cond=False):  # noqa: F722
-        if drop_audio_cond:  # cfg for cond audio
-            cond = torch.zeros_like(cond)
+    def forward(
+        self,
+        x: float["b n d"],  # noqa: F722
+        cond: float["b n d"] | None,  # noqa: F722
+        text_embed: float["b n d"] | None,  # noqa: F722
+        drop_audio_cond=False,
+        cond_embed: float["b n d"] | None = None,  # noqa: F722
+    ):
+        if cond_embed is not None:  # step-invariant cond & text part of proj already computed, see embed_cond()
+            x = F.linear(x, self.proj.weight[:, : self.mel_dim]) + cond_embed
+        else:
+            if isinstance(drop_audio_cond, torch.Tensor):  # per-sample cfg for cond audio
+                cond = cond.masked_fill(drop_audio_cond[:, None, None], 0.0)
+            elif drop_audio_cond:  # cfg for cond audio
+                cond = torch.zeros_like(cond)
+
+            x = self.proj(torch.cat((x, cond, text_embed), dim=-1))
 
-        x = self.proj(torch.cat((x, cond, text_embed), dim=-1))
         x = self.conv_pos_embed(x) + x
         return x
 
+    def embed_cond(self, cond: float["b n d"], text_embed: float["b n d"], drop_audio_cond=False):  # noqa: F722
+        # cond & text slice of proj (with bias), fixed across ode steps during sampling
+        if isinstance(drop_audio_cond, torch.Tensor):
+            cond = cond.masked_fill(drop_audio_cond[:, None, None], 0.0)
+        elif drop_audio_cond:
+            cond = torch.zeros_like(cond)
+
+        return F.linear(torch.cat((cond, text_embed), dim=-1), self.proj.weight[:, self.mel_dim :], self.proj.bias)
+
 
 # Flat UNet Transformer backbone
 
@@ -161,24 +186,47 @@ class UNetT(nn.Module):
         self.norm_out = RMSNorm(dim)
         self.proj_out = nn.Linear(dim, mel_dim)
 
+    def get_context(
+        self,
+        cond: float["b n d"],  # masked cond audio  # noqa: F722
+        text: int["b nt"],  # text  # noqa: F722
+        drop_audio_cond=False,  # cfg for cond audio, bool or bool["b"] per sample
+        drop_text=False,  # cfg for text, bool or bool["b"] per sample
+    ):
+        # text embedding and cond part of input projection do not change across ode steps, compute once per sampling
+        text_embed = self.text_embed(text, cond.shape[1], drop_text=drop_text)
+        return self.input_embed.embed_cond(cond, text_embed, drop_audio_cond=drop_audio_cond)
+
+    def get_time_modulation(self, time: float["s"]):  # time steps of a whole sampling schedule  # noqa: F821
+        # time embedding only depends on time, compute for all steps at once
+        return (self.time_embed(time),)  # s d
+
     def forward(
         self,
         x: float["b n d"],  # nosied input audio  # noqa: F722
         cond: float["b n d"],  # masked cond audio  # noqa: F722
         text: int["b nt"],  # text  # noqa: F722
         time: float["b"] | float[""],  # time step  # noqa: F821 F722
-        drop_audio_cond,  # cfg for cond audio
-        drop_text,  # cfg for text
+        drop_audio_cond,  # cfg for cond audio, bool or bool["b"] per sample
+        drop_text,  # cfg for text, bool or bool["b"] per sample
         mask: bool["b n"] | None = None,  # noqa: F722
+        context: float["b n d"] | None = None,  # from get_context(), then cond, text & drop flags unused  # noqa: F722
+        time_modulation: tuple | None = None,  # one step of get_time_modulation(), then time unused
     ):
         batch, seq_len = x.shape[0], x.shape[1]
         if time.ndim == 0:
             time = time.repeat(batch)
 
         # t: conditioning time, c: context (text + masked cond audio), x: noised input audio
-        t = self.time_embed(time)
-        text_embed = self.text_embed(text, seq_len, drop_text=drop_text)
-        x = self.input_embed(x, cond, text_embed, drop_audio_cond=drop_audio_cond)
+        if time_modulation is not None:
+            t = time_modulation[0].expand(batch, -1)
+        else:
+            t = self.time_embed(time)
+        if context is not None:
+            x = self.input_embed(x, None, None, cond_embed=context)
+        else:
+            text_embed = self.text_embed(text, seq_len, drop_text=drop_text)
+            x = self.input_embed(x, cond, text_embed, drop_audio_cond=drop_audio_cond)
 
         # postfix time t to input x, [b n d] -> [b n+1 d]
         x = torch.cat([t.unsqueeze(1), x], dim=1)  # pack t to x
@@ -9,6 +9,9 @@ d - dimension
 
 from __future__ import annotations
 
+import math
+import threading
+from collections import OrderedDict
 from random import random
 from typing import Callable
 
@@ -16,10 +19,17 @@ import torch
 import torch.nn.functional as F
 from torch import nn
 from torch.nn.utils.rnn import pad_sequence
-from torchdiffeq import odeint
 
+from f5_tts.model.backbones.dit import DiT
 from f5_tts.model.modules import MelSpec
+from f5_tts.model.solvers import (
+    FIXED_STEP_METHODS,
+    get_eval_times,
+    odeint_euler_adaptive,
+    odeint_fixed,
+)
 from f5_tts.model.utils import (
+    CancellationToken,
     default,
     exists,
     lens_to_mask,
@@ -71,6 +81,13 @@ class CFM(nn.Module):
         # sampling related
         self.odeint_kwargs = odeint_kwargs
 
+        # lru cache of precomputed time embedding & adaln modulation per sampling schedule, see get_time_modulation()
+        # valid for the weights it was computed with, cleared on load_state_dict and training forward, else call
+        # clear_time_modulation_cache() after changing weights
+        self.time_modulation_cache = OrderedDict()
+        self.time_modulation_cache_size = 16
+        self.transformer.register_load_state_dict_post_hook(self.clear_time_modulation_cache)
+
         # vocab map for tokenization
         self.vocab_char_map = vocab_char_map
 
@@ -78,6 +95,26 @@ class CFM(nn.Module):
     def device(self):
         return next(self.parameters()).device
 
+    # guards time_modulation_cache of sample() called from several threads, on the class so deepcopy (ema) works
+    time_modulation_lock = threading.Lock()
+
+    def clear_time_modulation_cache(self, *args):  # also as load_state_dict post hook of transformer
+        with self.time_modulation_lock:
+            self.time_modulation_cache.clear()
+
+    def get_time_modulation(self, t: float["s"], schedule: tuple):  # noqa: F821
+        # time grid is fully known given schedule (steps, sway coef, start, dtype, device), so is all time conditioning
+        with self.time_modulation_lock:
+            if schedule in self.time_modulation_cache:
+                self.time_modulation_cache.move_to_end(schedule)
+                return self.time_modulation_cache[schedule]
+
+            time_modulation = self.transformer.get_time_modulation(t)
+            self.time_modulation_cache[schedule] = time_modulation
+            if len(self.time_modulation_cache) > self.time_modulation_cache_size:
+                self.time_modulation_cache.popitem(last=False)
+            return time_modulation
+
     @torch.no_grad()
     def sample(
         self,
@@ -89,15 +126,37 @@ class CFM(nn.Module):
         steps=32,
         cfg_strength=1.0,
         sway_sampling_coef=None,
-        seed: int | None = None,
+        seed: int | list[int | None] | None = None,  # list for per item seeds
         max_duration=4096,
         vocoder: Callable[[float["b d n"]], float["b nw"]] | None = None,  # noqa: F722
         no_ref_audio=False,
         duplicate_test=False,
         t_inter=0.1,
         edit_mask=None,
+        fused_cfg=True,
+        return_trajectory=False,
+        callback: Callable[[int, float[""], float["b n d"]], None] | None = None,  # noqa: F722
+        deep_cache_interval=1,  # > 1 for full forward every k forwards of a branch, reuse middle blocks otherwise (dit)
+        deep_cache_layers=2,  # first & last blocks recomputed at cheap evaluations
+        cfg_interval: tuple[float, float] | None = None,  # only apply guidance for t within, e.g. (0.0, 0.8)
+        cfg_decay: str | None = None,  # None | linear | cosine, decay cfg strength to zero along t
+        cfg_null_interval=1,  # > 1 to evaluate uncond branch every k guided evaluations, reuse last one otherwise
+        early_stop_tol: float | None = None,  # euler only, item stops once relative change of estimated x1 below it
+        early_stop_min_steps: int | None = None,  # steps before checking convergence, default half of steps
+        stats: dict | None = None,  # filled with steps taken per item & number of early stopped items
+        cancel_token: CancellationToken | None = None,  # checked between steps, raises InferenceCancelled
     ):
         self.eval()
+
+        if exists(cancel_token):
+            cancel_token.check()
+            step_callback = callback
+
+            def callback(step, t, x):
+                if exists(step_callback):
+                    step_callback(step, t, x)
+                cancel_token.check()
+
         # raw wave
 
         if cond.ndim == 2:
@@ -157,32 +216,130 @@ class CFM(nn.Module):
         if no_ref_audio:
             cond = torch.zeros_like(cond)
 
+        # guidance schedule: strength zero outside cfg_interval, optionally decaying along t
+        # evaluations without guidance run the cond branch only, uncond branch may also be reused from last evaluation
+        guided = cfg_strength >= 1e-5
+        constant_cfg = cfg_interval is None and cfg_decay is None
+        assert cfg_decay in (None, "linear", "cosine"), f"Unknown cfg decay: {cfg_decay}"
+
+        def get_cfg_strength(t: float):
+            if exists(cfg_interval) and not cfg_interval[0] <= t <= cfg_interval[1]:
+                return 0.0
+            if cfg_decay == "linear":
+                return cfg_strength * (1 - t)
+            elif cfg_decay == "cosine":
+                return cfg_strength * math.cos(math.pi / 2 * t)
+            return cfg_strength
+
+        # text embedding and cond part of input projection are fixed across ode steps, precompute once as context
+        # fused cfg: stack cond & uncond inputs as one 2b batch, with per-sample drop flags, to run a single forward
+        null_context = cfg_context = cfg_mask = None
+        if not guided or not fused_cfg:
+            context = self.transformer.get_context(step_cond, text)
+            if guided:
+                null_context = self.transformer.get_context(step_cond, text, drop_audio_cond=True, drop_text=True)
+        else:
+            cfg_drop = torch.arange(2 * batch, device=device) >= batch  # False for cond half, True for uncond half
+            cfg_context = self.transformer.get_context(
+                torch.cat((step_cond, step_cond), dim=0),
+                torch.cat((text, text), dim=0),
+                drop_audio_cond=cfg_drop,
+                drop_text=cfg_drop,
+            )
+            cfg_mask = torch.cat((mask, mask), dim=0) if exists(mask) else None
+            # cond half, for evaluations running cond branch only
+            if isinstance(cfg_context, tuple):
+                context = tuple(c[:batch] for c in cfg_context)
+            else:
+                context = cfg_context[:batch]
+
+        # deepcache, one residual cache per forward branch (cond, uncond, fused), each refreshed every k forwards
+        if deep_cache_interval > 1:
+            assert isinstance(self.transformer, DiT), "deep cache is only supported by DiT backbone"
+        deep_caches = dict()
+
+        def transformer(x, t, context, mask, time_modulation, branch):
+            cache_kwargs = dict()
+            if deep_cache_interval > 1:
+                cache = deep_caches.setdefault(branch, dict(layers=deep_cache_layers, forwards=0))
+                cache_kwargs = dict(deep_cache=cache, reuse_deep_cache=cache["forwards"] % deep_cache_interval != 0)
+                cache["forwards"] += 1
+            # cond, text & drop flags are carried by context
+            return self.transformer(
+                x=x,
+                cond=None,
+                text=None,
+                time=t,
+                mask=mask,
+                drop_audio_cond=False,
+                drop_text=False,
+                context=context,
+                time_modulation=time_modulation,
+                **cache_kwargs,
+            )
+
         # neural ode
 
-        def fn(t, x):
+        num_guided, null_pred = 0, None
+
+        def fn(t, x, i=None):  # i: index of t in precomputed time conditioning table, if any
             # at each step, conditioning is fixed
             # step_cond = torch.where(cond_mask, cond, torch.zeros_like(cond))
 
-            # predict flow
-            pred = self.transformer(
-                x=x, cond=step_cond, text=text, time=t, mask=mask, drop_audio_cond=False, drop_text=False
-            )
-            if cfg_strength < 1e-5:
-                return pred
-
-            null_pred = self.transformer(
-                x=x, cond=step_cond, text=text, time=t, mask=mask, drop_audio_cond=True, drop_text=True
-            )
-            return pred + (pred - null_pred) * cfg_strength
+            time_modulation = tuple(table[i : i + 1] for table in time_table) if exists(i) else None
+
+            strength = 0.0
+            if guided:
+                strength = cfg_strength if constant_cfg else get_cfg_strength(eval_times[i] if exists(i) else t.item())
+            if strength < 1e-5:
+                return transformer(x, t, context, mask, time_modulation, "cond")
+
+            # evaluate uncond branch every cfg_null_interval guided evaluations, otherwise reuse last one
+            nonlocal num_guided, null_pred
+            update_null = num_guided % cfg_null_interval == 0
+            num_guided += 1
+
+            if not update_null:
+                pred = transformer(x, t, context, mask, time_modulation, "cond")
+            elif fused_cfg:
+                # predict flow for both branches with a single forward
+                pred, null_pred = transformer(
+                    torch.cat((x, x), dim=0), t, cfg_context, cfg_mask, time_modulation, "fused"
+                ).chunk(2, dim=0)
+            else:
+                pred = transformer(x, t, context, mask, time_modulation, "cond")
+                null_pred = transformer(x, t, null_context, mask, time_modulation, "null")
+            return pred + (pred - null_pred) * strength
+
+        # adaptive early stop, converged items leave the batch, so do their per item conditioning & caches
+        def select(v, keep):
+            if v is None:
+                return None
+            elif isinstance(v, tuple):
+                return tuple(c[keep] for c in v)
+            return v[keep]
+
+        def drop_items(keep: bool["b"]):  # noqa: F821
+            nonlocal context, null_context, cfg_context, mask, cfg_mask, null_pred
+            cfg_keep = torch.cat((keep, keep), dim=0)
+            context, null_context, mask, null_pred = (select(v, keep) for v in (context, null_context, mask, null_pred))
+            cfg_context, cfg_mask = select(cfg_context, cfg_keep), select(cfg_mask, cfg_keep)
+            for branch, cache in deep_caches.items():
+                if "residual" in cache:
+                    cache["residual"] = cache["residual"][cfg_keep if branch == "fused" else keep]
 
         # noise input
         # to make sure batch inference result is same with different batch size, and for sure single inference
         # still some difference maybe due to convolutional layers
+        # own generator for each seeded item, independent of other items & requests, global rng state untouched
+        seeds = seed if isinstance(seed, (list, tuple)) else [seed] * batch
+        assert len(seeds) == batch, "number of seeds should match batch size"
         y0 = []
-        for dur in duration:
-            if exists(seed):
-                torch.manual_seed(seed)
-            y0.append(torch.randn(dur, self.num_channels, device=self.device, dtype=step_cond.dtype))
+        for dur, item_seed in zip(duration, seeds):
+            generator = torch.Generator(device=self.device).manual_seed(item_seed) if exists(item_seed) else None
+            y0.append(
+                torch.randn(dur, self.num_channels, device=self.device, dtype=step_cond.dtype, generator=generator)
+            )
         y0 = pad_sequence(y0, padding_value=0, batch_first=True)
 
         t_start = 0
@@ -197,9 +354,66 @@ class CFM(nn.Module):
         if sway_sampling_coef is not None:
             t = t + sway_sampling_coef * (torch.cos(torch.pi / 2 * t) - 1 + t)
 
-        trajectory = odeint(fn, y0, t, **self.odeint_kwargs)
+        method = self.odeint_kwargs.get("method")
+        if exists(early_stop_tol):
+            assert method == "euler" and "options" not in self.odeint_kwargs, "adaptive early stop only supports euler"
+
+        if method in FIXED_STEP_METHODS and "options" not in self.odeint_kwargs:
+            # native fixed-step solver, all evaluation times known ahead so is time conditioning
+            eval_times = get_eval_times(t, method)
+            time_table = self.get_time_modulation(
+                eval_times, schedule=(method, steps, sway_sampling_coef, t_start, eval_times.dtype, eval_times.device)
+            )
+            if guided and not constant_cfg:  # guidance schedule on host, no sync per evaluation
+                eval_times = eval_times.tolist()
+            if exists(early_stop_tol):
+                sampled, trajectory, steps_taken = odeint_euler_adaptive(
+                    fn,
+                    y0,
+                    t,
+                    tol=early_stop_tol,
+                    min_steps=default(early_stop_min_steps, steps // 2),
+                    on_drop=drop_items,
+                    return_trajectory=return_trajectory,
+                    callback=callback,
+                )
+                if exists(stats):
+                    stats.update(steps=steps_taken.tolist(), early_stopped=(steps_taken < steps).sum().item())
+            else:
+                sampled, trajectory = odeint_fixed(
+                    fn, y0, t, method=method, return_trajectory=return_trajectory, callback=callback
+                )
+
+        else:
+            from torchdiffeq import odeint
+
+            # torchdiffeq calls callback_step before each attempted step, report the one just finished, so steps count
+            # from 0 as odeint_fixed does, adaptive methods (dopri5, ...) counting accepted steps, rejected ones skipped
+            step = 0
+            attempted = False
+
+            def callback_step(t0, y0, dt):
+                nonlocal step, attempted
+                if attempted:
+                    callback(step, t0, y0)
+                    step += 1
+                attempted = True
+
+            def callback_reject_step(t0, y0, dt):
+                nonlocal attempted
+                attempted = False
+
+            if exists(callback):
+                fn.callback_step = callback_step
+                fn.callback_reject_step = callback_reject_step
+
+            trajectory = odeint(fn, y0, t, **self.odeint_kwargs)
+            sampled = trajectory[-1]
+            if exists(callback) and attempted:
+                callback(step, t[-1], sampled)
+            if not return_trajectory:
+                trajectory = None
 
-        sampled = trajectory[-1]
         out = sampled
         out = torch.where(cond_mask, cond, out)
 
@@ -217,6 +431,8 @@ class CFM(nn.Module):
         lens: int["b"] | None = None,  # noqa: F821
         noise_scheduler: str | None = None,
     ):
+        self.clear_time_modulation_cache()  # weights change with each training step
+
         # handle raw wave
         if inp.ndim == 2:
             inp = self.mel_spec(inp)
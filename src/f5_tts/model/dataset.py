@@ -11,7 +11,7 @@ from torch import nn
 from torch.utils.data import Dataset, Sampler
 from tqdm import tqdm
 
-from f5_tts.model.modules import MelSpec
+from f5_tts.model.modules import MelSpec, resample
 from f5_tts.model.utils import default
 
 
@@ -62,9 +62,7 @@ class HFDataset(Dataset):
 
         audio_tensor = torch.from_numpy(audio).float()
 
-        if sample_rate != self.target_sample_rate:
-            resampler = torchaudio.transforms.Resample(sample_rate, self.target_sample_rate)
-            audio_tensor = resampler(audio_tensor)
+        audio_tensor = resample(audio_tensor, sample_rate, self.target_sample_rate)
 
         audio_tensor = audio_tensor.unsqueeze(0)  # 't -> 1 t')
 
@@ -149,9 +147,7 @@ class CustomDataset(Dataset):
                 audio = torch.mean(audio, dim=0, keepdim=True)
 
             # resample if necessary
-            if source_sample_rate != self.target_sample_rate:
-                resampler = torchaudio.transforms.Resample(source_sample_rate, self.target_sample_rate)
-                audio = resampler(audio)
+            audio = resample(audio, source_sample_rate, self.target_sample_rate)
 
             # to mel spectrogram
             mel_spec = self.mel_spectrogram(audio)
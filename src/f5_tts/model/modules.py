@@ -10,6 +10,7 @@ d - dimension
 from __future__ import annotations
 
 import math
+from functools import lru_cache
 from typing import Optional
 
 import torch
@@ -25,6 +26,19 @@ from x_transformers.x_transformers import apply_rotary_pos_emb
 
 mel_basis_cache = {}
 hann_window_cache = {}
+mel_stft_cache = {}
+
+
+def reflect_pad(waveform, padding, lens=None):
+    # 'b nw -> b (nw + 2 * padding)', reflected at both ends; with lens, each at its own end and zeros after
+    if lens is None:
+        return F.pad(waveform.unsqueeze(1), (padding, padding), mode="reflect").squeeze(1)
+
+    idx = torch.arange(-padding, waveform.shape[-1] + padding, device=waveform.device)
+    lens = lens.to(waveform.device).unsqueeze(1)
+    src = torch.where(idx < 0, -idx, torch.where(idx >= lens, 2 * (lens - 1) - idx, idx))
+    padded = waveform.gather(1, src.clamp(0, waveform.shape[-1] - 1))
+    return padded.masked_fill(idx >= lens + padding, 0.0)
 
 
 def get_bigvgan_mel_spectrogram(
@@ -37,20 +51,21 @@ def get_bigvgan_mel_spectrogram(
     fmin=0,
     fmax=None,
     center=False,
+    lens=None,
 ):  # Copy from https://github.com/NVIDIA/BigVGAN/tree/main
     device = waveform.device
-    key = f"{n_fft}_{n_mel_channels}_{target_sample_rate}_{hop_length}_{win_length}_{fmin}_{fmax}_{device}"
+    key = f"{n_fft}_{n_mel_channels}_{target_sample_rate}_{hop_length}_{win_length}_{fmin}_{fmax}_{device}_{waveform.dtype}"
 
     if key not in mel_basis_cache:
         mel = librosa_mel_fn(sr=target_sample_rate, n_fft=n_fft, n_mels=n_mel_channels, fmin=fmin, fmax=fmax)
-        mel_basis_cache[key] = torch.from_numpy(mel).float().to(device)  # TODO: why they need .float()?
-        hann_window_cache[key] = torch.hann_window(win_length).to(device)
+        mel_basis_cache[key] = torch.from_numpy(mel).to(device, waveform.dtype)
+        hann_window_cache[key] = torch.hann_window(win_length).to(device, waveform.dtype)
 
     mel_basis = mel_basis_cache[key]
     hann_window = hann_window_cache[key]
 
     padding = (n_fft - hop_length) // 2
-    waveform = torch.nn.functional.pad(waveform.unsqueeze(1), (padding, padding), mode="reflect").squeeze(1)
+    waveform = reflect_pad(waveform, padding, lens)
 
     spec = torch.stft(
         waveform,
@@ -79,24 +94,31 @@ def get_vocos_mel_spectrogram(
     target_sample_rate=24000,
     hop_length=256,
     win_length=1024,
+    lens=None,
 ):
-    mel_stft = torchaudio.transforms.MelSpectrogram(
-        sample_rate=target_sample_rate,
-        n_fft=n_fft,
-        win_length=win_length,
-        hop_length=hop_length,
-        n_mels=n_mel_channels,
-        power=1,
-        center=True,
-        normalized=False,
-        norm=None,
-    ).to(waveform.device)
     if len(waveform.shape) == 3:
         waveform = waveform.squeeze(1)  # 'b 1 nw -> b nw'
 
     assert len(waveform.shape) == 2
 
-    mel = mel_stft(waveform)
+    device = waveform.device
+    key = f"{n_fft}_{n_mel_channels}_{target_sample_rate}_{hop_length}_{win_length}_{device}_{waveform.dtype}"
+
+    if key not in mel_stft_cache:
+        mel_stft_cache[key] = torchaudio.transforms.MelSpectrogram(
+            sample_rate=target_sample_rate,
+            n_fft=n_fft,
+            win_length=win_length,
+            hop_length=hop_length,
+            n_mels=n_mel_channels,
+            power=1,
+            center=False,  # padded as center=True would, but per item
+            normalized=False,
+            norm=None,
+        ).to(device, waveform.dtype)
+    mel_stft = mel_stft_cache[key]
+
+    mel = mel_stft(reflect_pad(waveform, n_fft // 2, lens))
     mel = mel.clamp(min=1e-5).log()
     return mel
 
@@ -119,18 +141,21 @@ class MelSpec(nn.Module):
         self.win_length = win_length
         self.n_mel_channels = n_mel_channels
         self.target_sample_rate = target_sample_rate
+        self.mel_spec_type = mel_spec_type
 
+        # filterbank and window built once per device and dtype, cached at module level and shared
         if mel_spec_type == "vocos":
             self.extractor = get_vocos_mel_spectrogram
         elif mel_spec_type == "bigvgan":
             self.extractor = get_bigvgan_mel_spectrogram
 
-        self.register_buffer("dummy", torch.tensor(0), persistent=False)
-
-    def forward(self, wav):
-        if self.dummy.device != wav.device:
-            self.to(wav.device)
+    def get_frame_lens(self, lens):
+        # mel frames of waves with lens samples
+        padding = self.n_fft // 2 if self.mel_spec_type == "vocos" else (self.n_fft - self.hop_length) // 2
+        return (lens + 2 * padding - self.n_fft) // self.hop_length + 1
 
+    def forward(self, wav, lens=None):
+        # wav: 'b nw', lens: 'b', samples of each wave if padded to batch, mel frames past them zeroed
         mel = self.extractor(
             waveform=wav,
             n_fft=self.n_fft,
@@ -138,11 +163,41 @@ class MelSpec(nn.Module):
             target_sample_rate=self.target_sample_rate,
             hop_length=self.hop_length,
             win_length=self.win_length,
+            lens=lens,
         )
 
+        if lens is not None:
+            frame_lens = self.get_frame_lens(lens.to(mel.device))
+            mel = mel.masked_fill(torch.arange(mel.shape[-1], device=mel.device) >= frame_lens[:, None, None], 0.0)
+
         return mel
 
 
+# resample raw wav, sinc kernel built once per (orig_sr, new_sr, device, dtype) and shared in process
+
+
+@lru_cache(maxsize=32)
+def get_resampler(orig_sr, new_sr, device="cpu", dtype=torch.float32):
+    return torchaudio.transforms.Resample(orig_sr, new_sr).to(device, dtype)
+
+
+def resample(waveform, orig_sr, new_sr):
+    # '... nw' -> '... nw_new', as is if same rate
+    if orig_sr == new_sr:
+        return waveform
+    return get_resampler(orig_sr, new_sr, waveform.device, waveform.dtype)(waveform)
+
+
+def resample_batch(waveforms, orig_sr, new_sr):
+    # list of '... nw' at the same rate (same leading dims) resampled in one call, each as resampled alone
+    if orig_sr == new_sr:
+        return list(waveforms)
+    max_len = max(wave.shape[-1] for wave in waveforms)
+    batch = torch.stack([F.pad(wave, (0, max_len - wave.shape[-1])) for wave in waveforms])
+    batch = resample(batch, orig_sr, new_sr)
+    return [wave[..., : -(-new_sr * orig.shape[-1] // orig_sr)] for wave, orig in zip(batch, waveforms)]
+
+
 # sinusoidal position embedding
 
 
@@ -282,13 +337,17 @@ class AdaLayerNormZero(nn.Module):
 
         self.norm = nn.LayerNorm(dim, elementwise_affine=False, eps=1e-6)
 
-    def forward(self, x, emb=None):
-        emb = self.linear(self.silu(emb))
-        shift_msa, scale_msa, gate_msa, shift_mlp, scale_mlp, gate_mlp = torch.chunk(emb, 6, dim=1)
+    def forward(self, x, emb=None, modulation=None):  # modulation: precomputed from get_modulation(), emb then unused
+        if modulation is None:
+            modulation = self.get_modulation(emb)
+        shift_msa, scale_msa, gate_msa, shift_mlp, scale_mlp, gate_mlp = torch.chunk(modulation, 6, dim=1)
 
         x = self.norm(x) * (1 + scale_msa[:, None]) + shift_msa[:, None]
         return x, gate_msa, shift_mlp, scale_mlp, gate_mlp
 
+    def get_modulation(self, emb):
+        return self.linear(self.silu(emb))
+
 
 # AdaLayerNormZero for final layer
 # return only with modulated x for attn input, cuz no more mlp modulation
@@ -303,13 +362,17 @@ class AdaLayerNormZero_Final(nn.Module):
 
         self.norm = nn.LayerNorm(dim, elementwise_affine=False, eps=1e-6)
 
-    def forward(self, x, emb):
-        emb = self.linear(self.silu(emb))
-        scale, shift = torch.chunk(emb, 2, dim=1)
+    def forward(self, x, emb=None, modulation=None):  # modulation: precomputed from get_modulation(), emb then unused
+        if modulation is None:
+            modulation = self.get_modulation(emb)
+        scale, shift = torch.chunk(modulation, 2, dim=1)
 
         x = self.norm(x) * (1 + scale)[:, None, :] + shift[:, None, :]
         return x
 
+    def get_modulation(self, emb):
+        return self.linear(self.silu(emb))
+
 
 # FeedForward
 
@@ -555,9 +618,9 @@ class DiTBlock(nn.Module):
         self.ff_norm = nn.LayerNorm(dim, elementwise_affine=False, eps=1e-6)
         self.ff = FeedForward(dim=dim, mult=ff_mult, dropout=dropout, approximate="tanh")
 
-    def forward(self, x, t, mask=None, rope=None):  # x: noised input, t: time embedding
+    def forward(self, x, t, mask=None, rope=None, modulation=None):  # x: noised input, t: time embedding
         # pre-norm & modulation for attention input
-        norm, gate_msa, shift_mlp, scale_mlp, gate_mlp = self.attn_norm(x, emb=t)
+        norm, gate_msa, shift_mlp, scale_mlp, gate_mlp = self.attn_norm(x, emb=t, modulation=modulation)
 
         # attention
         attn_output = self.attn(x=norm, mask=mask, rope=rope)
@@ -611,13 +674,18 @@ class MMDiTBlock(nn.Module):
         self.ff_norm_x = nn.LayerNorm(dim, elementwise_affine=False, eps=1e-6)
         self.ff_x = FeedForward(dim=dim, mult=ff_mult, dropout=dropout, approximate="tanh")
 
-    def forward(self, x, c, t, mask=None, rope=None, c_rope=None):  # x: noised input, c: context, t: time embedding
+    def forward(self, x, c, t, mask=None, rope=None, c_rope=None, modulation=None):
+        # x: noised input, c: context, t: time embedding, modulation: precomputed (c_modulation, x_modulation)
+        c_modulation, x_modulation = modulation if modulation is not None else (None, None)
+
         # pre-norm & modulation for attention input
         if self.context_pre_only:
-            norm_c = self.attn_norm_c(c, t)
+            norm_c = self.attn_norm_c(c, t, modulation=c_modulation)
         else:
-            norm_c, c_gate_msa, c_shift_mlp, c_scale_mlp, c_gate_mlp = self.attn_norm_c(c, emb=t)
-        norm_x, x_gate_msa, x_shift_mlp, x_scale_mlp, x_gate_mlp = self.attn_norm_x(x, emb=t)
+            norm_c, c_gate_msa, c_shift_mlp, c_scale_mlp, c_gate_mlp = self.attn_norm_c(
+                c, emb=t, modulation=c_modulation
+            )
+        norm_x, x_gate_msa, x_shift_mlp, x_scale_mlp, x_gate_mlp = self.attn_norm_x(x, emb=t, modulation=x_modulation)
 
         # attention
         x_attn_output, c_attn_output = self.attn(x=norm_x, c=norm_c, mask=mask, rope=rope, c_rope=c_rope)
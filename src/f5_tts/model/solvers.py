@@ -0,0 +1,255 @@
+"""
+ein notation:
+b - batch
+n - sequence
+d - dimension
+s - time steps
+e - velocity evaluations
+"""
+
+from __future__ import annotations
+
+import math
+from typing import Callable
+
+import torch
+
+
+# fixed-step ode solvers for flow matching sampling
+# integrate in place on a single state buffer, keep no intermediate states unless asked to
+
+MULTISTEP_METHODS = ("dpm++2m", "unipc")  # one evaluation per step, high order by reusing previous evaluations
+FIXED_STEP_METHODS = ("euler", "midpoint", "heun") + MULTISTEP_METHODS
+
+
+def get_eval_times(t: float["s"], method: str) -> float["e"]:  # noqa: F821
+    # times at which a method evaluates the velocity over time grid t, in call order
+    t0, t1 = t[:-1], t[1:]
+    if method == "euler" or method in MULTISTEP_METHODS:
+        return t0
+    elif method == "midpoint":
+        return torch.stack((t0, t0 + 0.5 * (t1 - t0)), dim=1).flatten()
+    elif method == "heun":
+        return torch.stack((t0, t1), dim=1).flatten()
+    else:
+        raise ValueError(f"Unknown fixed-step method: {method}, choose from {FIXED_STEP_METHODS}")
+
+
+def odeint_fixed(
+    fn: Callable,  # fn(t, x, i) -> velocity, i: index of t in get_eval_times()
+    y0: float["b n d"],  # noqa: F722
+    t: float["s"],  # noqa: F821
+    method="euler",
+    return_trajectory=False,
+    callback: Callable | None = None,  # callback(step, t, x), called after each step
+):
+    if method in MULTISTEP_METHODS:
+        return odeint_multistep(fn, y0, t, method=method, return_trajectory=return_trajectory, callback=callback)
+
+    eval_times = get_eval_times(t, method)
+    evals_per_step = len(eval_times) // (len(t) - 1)
+
+    x = y0  # state buffer, updated in place
+    buffer = torch.empty_like(x) if evals_per_step > 1 else None
+    if return_trajectory:
+        trajectory = torch.empty((len(t), *x.shape), dtype=x.dtype, device=x.device)
+        trajectory[0] = x
+    else:
+        trajectory = None
+
+    for step in range(len(t) - 1):
+        dt = t[step + 1] - t[step]
+        i = step * evals_per_step
+
+        if method == "euler":
+            v = fn(eval_times[i], x, i)
+            x.addcmul_(v, dt)
+        elif method == "midpoint":
+            v = fn(eval_times[i], x, i)
+            torch.addcmul(x, v, 0.5 * dt, out=buffer)
+            v = fn(eval_times[i + 1], buffer, i + 1)
+            x.addcmul_(v, dt)
+        elif method == "heun":
+            v = fn(eval_times[i], x, i)
+            torch.addcmul(x, v, dt, out=buffer)
+            v = v + fn(eval_times[i + 1], buffer, i + 1)
+            x.addcmul_(v, 0.5 * dt)
+
+        if return_trajectory:
+            trajectory[step + 1] = x
+        if callback is not None:
+            callback(step, t[step + 1], x)
+
+    return x, trajectory
+
+
+# multistep solvers for rectified flow, x_t = (1 - t) * x_0 + t * x_1, velocity v = x_1 - x_0
+# work on data prediction x_1 = x_t + (1 - t) * v, i.e. alpha_t = t, sigma_t = 1 - t, lambda_t = log(alpha_t / sigma_t)
+# dpm++2m: DPM-Solver++(2M) https://arxiv.org/abs/2211.01095
+# unipc: UniPC-bh2 https://arxiv.org/abs/2302.04867, predictor of same order plus a corrector reusing next evaluation
+
+
+def _lambda(t: float):
+    if t <= 0:
+        return -math.inf
+    if t >= 1:
+        return math.inf
+    return math.log(t) - math.log1p(-t)
+
+
+def _unipc_coefficients(s0: float, t: float, prev: list[float], corrector=False):
+    # step s0 -> t, with earlier evaluated times prev (most recent first) for higher order
+    # returns x_t = ratio * x_s0 + coef_m0 * m0 + coef_res * (sum(rhos[k] * (m_k - m0) / rks[k]) [+ rhos[-1] * (m_t - m0)])
+    h = _lambda(t) - _lambda(s0)
+    rks = [(_lambda(p) - _lambda(s0)) / h for p in prev] + [1.0]
+    order = len(rks)
+
+    hh = -h  # data prediction
+    h_phi_1 = math.expm1(hh)
+    b_h = h_phi_1  # bh2
+
+    R, b = [], []
+    h_phi_k = h_phi_1 / hh - 1
+    factorial_i = 1
+    for i in range(1, order + 1):
+        R.append([rk ** (i - 1) for rk in rks])
+        b.append(h_phi_k * factorial_i / b_h)
+        factorial_i *= i + 1
+        h_phi_k = h_phi_k / hh - 1 / factorial_i
+
+    if corrector:
+        rhos = [0.5] if order == 1 else torch.linalg.solve(torch.tensor(R), torch.tensor(b)).tolist()
+    elif order == 1:
+        rhos = []
+    elif order == 2:
+        rhos = [0.5]
+    else:
+        R = [row[:-1] for row in R[:-1]]
+        rhos = torch.linalg.solve(torch.tensor(R), torch.tensor(b[:-1])).tolist()
+
+    return (1 - t) / (1 - s0), -t * h_phi_1, -t * b_h, rks[:-1], rhos
+
+
+def odeint_multistep(
+    fn: Callable,  # fn(t, x, i) -> velocity, i: step index
+    y0: float["b n d"],  # noqa: F722
+    t: float["s"],  # noqa: F821
+    method="unipc",
+    order=2,
+    return_trajectory=False,
+    callback: Callable | None = None,  # callback(step, t, x), called after each step
+):
+    assert method in MULTISTEP_METHODS, f"Unknown multistep method: {method}, choose from {MULTISTEP_METHODS}"
+    if method == "dpm++2m":
+        order = 2
+    use_corrector = method == "unipc"
+
+    times = t.tolist()  # coefficients are plain floats, computed on host once
+    x = y0  # state buffer, updated in place
+    last_x = torch.empty_like(x) if use_corrector else None
+    if return_trajectory:
+        trajectory = torch.empty((len(t), *x.shape), dtype=x.dtype, device=x.device)
+        trajectory[0] = x
+    else:
+        trajectory = None
+
+    history = []  # (time, data prediction) of previous evaluations with finite lambda, most recent last
+    last_step = None  # (time, data prediction, history used) of previous step, for corrector
+
+    for step in range(len(times) - 1):
+        s0, s1 = times[step], times[step + 1]
+        m0 = x + (1 - s0) * fn(t[step], x, step)
+
+        # corrector, refine current state with the evaluation just made, no extra nfe
+        if use_corrector and last_step is not None:
+            p_s0, p_m0, p_hist = last_step
+            ratio, coef_m0, coef_res, rks, rhos = _unipc_coefficients(p_s0, s0, [p for p, _ in p_hist], corrector=True)
+            res = rhos[-1] * (m0 - p_m0)
+            for rho, rk, (_, m) in zip(rhos[:-1], rks, p_hist):
+                res = res + rho / rk * (m - p_m0)
+            x.copy_(last_x).mul_(ratio).add_(p_m0, alpha=coef_m0).add_(res, alpha=coef_res)
+
+        # predictor, lower order at warmup and for the final step (lambda at t = 1 is infinite, unstable if higher)
+        this_order = 1 if s0 <= 0 or step == len(times) - 2 else min(order, len(history) + 1)
+        hist = history[::-1][: this_order - 1]
+        ratio, coef_m0, coef_res, rks, rhos = _unipc_coefficients(s0, s1, [p for p, _ in hist])
+        if use_corrector:
+            last_x.copy_(x)
+        x.mul_(ratio).add_(m0, alpha=coef_m0)
+        if rhos:
+            res = 0
+            for rho, rk, (_, m) in zip(rhos, rks, hist):
+                res = res + rho / rk * (m - m0)
+            x.add_(res, alpha=coef_res)
+
+        last_step = (s0, m0, hist)
+        if s0 > 0:
+            history = (history + [(s0, m0)])[-order:]
+
+        if return_trajectory:
+            trajectory[step + 1] = x
+        if callback is not None:
+            callback(step, t[step + 1], x)
+
+    return x, trajectory
+
+
+def odeint_euler_adaptive(
+    fn: Callable,  # fn(t, x, i) -> velocity, x: rows of items still sampling
+    y0: float["b n d"],  # noqa: F722
+    t: float["s"],  # noqa: F821
+    tol=1e-3,  # relative change of endpoint estimate x_1 = x_t + (1 - t) * v between steps
+    min_steps=1,  # steps always taken before checking convergence
+    on_drop: Callable | None = None,  # on_drop(keep), keep: bool["b"] of rows still sampling, after it x shrinks
+    return_trajectory=False,
+    callback: Callable | None = None,  # callback(step, t, x), called after each step, x of all items
+):
+    # euler with per item early stop, converged items jump to t = 1 with their endpoint estimate and leave the batch
+    # deciding to stop is host side control flow, so syncs once per step after min_steps
+    x = y0  # all items, updated in place
+    active = None  # indices of items still sampling, None for all
+    x_active = x
+    last_x1 = None
+    steps_taken = torch.full((x.shape[0],), len(t) - 1, dtype=torch.long)
+    if return_trajectory:
+        trajectory = torch.empty((len(t), *x.shape), dtype=x.dtype, device=x.device)
+        trajectory[0] = x
+    else:
+        trajectory = None
+
+    for step in range(len(t) - 1):
+        v = fn(t[step], x_active, step)
+        x1 = torch.addcmul(x_active, v, 1 - t[step])
+
+        if last_x1 is not None and step >= min_steps:
+            delta = (x1 - last_x1).flatten(1).norm(dim=1) / x1.flatten(1).norm(dim=1).clamp(min=1e-6)
+            converged = (delta < tol).cpu()
+            if converged.any():
+                index = torch.arange(x.shape[0]) if active is None else active
+                steps_taken[index[converged]] = step + 1
+                x[index[converged].to(x.device)] = x1[converged.to(x.device)]
+
+                keep = ~converged
+                active = index[keep]
+                if len(active) == 0:  # all items done, rest of trajectory stays at endpoints
+                    if return_trajectory:
+                        trajectory[step + 1 :] = x
+                    if callback is not None:
+                        callback(step, t[-1], x)
+                    break
+                keep = keep.to(x.device)
+                x_active, v, x1 = x_active[keep], v[keep], x1[keep]
+                if on_drop is not None:
+                    on_drop(keep)
+        last_x1 = x1
+
+        x_active.addcmul_(v, t[step + 1] - t[step])
+        if active is not None:
+            x[active.to(x.device)] = x_active
+
+        if return_trajectory:
+            trajectory[step + 1] = x
+        if callback is not None:
+            callback(step, t[step + 1], x)
+
+    return x, trajectory, steps_taken
@@ -2,9 +2,14 @@ from __future__ import annotations
 
 import os
 import random
+import threading
+import time
 from collections import defaultdict
+from functools import lru_cache
 from importlib.resources import files
+from itertools import chain, repeat
 
+import numpy as np
 import torch
 from torch.nn.utils.rnn import pad_sequence
 
@@ -36,6 +41,55 @@ def default(v, d):
     return v if exists(v) else d
 
 
+# cancellation
+
+
+class InferenceCancelled(Exception):
+    pass
+
+
+class CancellationToken:
+    """
+    Cancels an inference from another thread, or once past its deadline (timeout in seconds).
+    Checked by CFM.sample between ODE steps and by chunk inference between chunks, raising InferenceCancelled.
+    """
+
+    def __init__(self, timeout=None):
+        self.event = threading.Event()
+        self.deadline = time.monotonic() + timeout if exists(timeout) else None
+        self.reason = None
+        self.callbacks = []
+        self.lock = threading.Lock()
+
+    def add_callback(self, callback):
+        """callback(reason) once cancelled, by the thread cancelling or checking past deadline, at once if already."""
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(callback)
+                return
+        callback(self.reason)
+
+    def cancel(self, reason="cancelled"):
+        with self.lock:
+            if self.event.is_set():
+                return
+            self.reason = reason
+            self.event.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback(reason)
+
+    @property
+    def cancelled(self):
+        if not self.event.is_set() and exists(self.deadline) and time.monotonic() > self.deadline:
+            self.cancel("deadline exceeded")
+        return self.event.is_set()
+
+    def check(self):
+        if self.cancelled:
+            raise InferenceCancelled(self.reason)
+
+
 # tensor helpers
 
 
@@ -89,10 +143,14 @@ def list_str_to_idx(
     text: list[str] | list[list[str]],
     vocab_char_map: dict[str, int],  # {char: idx}
     padding_value=-1,
+    dtype=torch.long,  # or torch.int32 to save a cast if fed to int32 embedding lookup
 ) -> int["b nt"]:  # noqa: F722
-    list_idx_tensors = [torch.tensor([vocab_char_map.get(c, 0) for c in t]) for t in text]  # pinyin or char style
-    text = pad_sequence(list_idx_tensors, padding_value=padding_value, batch_first=True)
-    return text
+    lens = np.fromiter(map(len, text), dtype=np.int64, count=len(text))
+    # all tokens looked up in one pass at C level, pinyin or char style
+    idx = np.fromiter(map(vocab_char_map.get, chain.from_iterable(text), repeat(0)), dtype=np.int64, count=lens.sum())
+    out = torch.full((len(text), lens.max(initial=0)), padding_value, dtype=dtype)
+    out[torch.from_numpy(np.arange(out.shape[1]) < lens[:, None])] = torch.from_numpy(idx).to(dtype)
+    return out
 
 
 # Get tokenizer
@@ -137,44 +195,94 @@ jieba.initialize()
 print("Word segmentation module jieba initialized.\n")
 
 
-def convert_char_to_pinyin(text_list, polyphone=True):
-    final_text_list = []
+class TextFrontend:
+    """
+    Text to tokens (chinese to pinyin, see convert_char_to_pinyin), memoized.
+    jieba segments each block of chinese characters & alphanumerics on its own, so blocks are cut only once and each
+    segment converted only once, kept in LRU caches: e.g. the reference text prepended to every chunk. Blocks over
+    cut_cache_max_len characters are cut every time, so long pasted text does not pin memory.
+    Thread-safe; caches are not aware of words later added to jieba dict.
+    """
+
     custom_trans = str.maketrans(
         {";": ",", "“": '"', "”": '"', "‘": "'", "’": "'"}
     )  # add custom trans here, to address oov
 
+    def __init__(self, polyphone=True, cache_size=2**16, cut_cache_size=2**12, cut_cache_max_len=128):
+        self.polyphone = polyphone
+        self.cut_cache_max_len = cut_cache_max_len
+        self.cached_cut = lru_cache(maxsize=cut_cache_size)(self._cut)
+        self.convert_segment = lru_cache(maxsize=cache_size)(self._convert_segment)
+
+    @staticmethod
+    def _cut(block):
+        return tuple(jieba.cut(block))
+
+    def cut(self, block):
+        # blocks are whole runs of user text, only short ones are cached (as those of reference text, repeated most)
+        if len(block) > self.cut_cache_max_len:
+            return self._cut(block)
+        return self.cached_cut(block)
+
+    @staticmethod
     def is_chinese(c):
         return (
             "\u3100" <= c <= "\u9fff"  # common chinese characters
         )
 
-    for text in text_list:
+    def _convert_segment(self, seg):
+        # (tokens, is pure alphabets and symbols)
+        seg_byte_len = len(bytes(seg, "UTF-8"))
+        if seg_byte_len == len(seg):  # if pure alphabets and symbols
+            return tuple(seg), True
+
         char_list = []
-        text = text.translate(custom_trans)
-        for seg in jieba.cut(text):
-            seg_byte_len = len(bytes(seg, "UTF-8"))
-            if seg_byte_len == len(seg):  # if pure alphabets and symbols
-                if char_list and seg_byte_len > 1 and char_list[-1] not in " :'\"":
+        if self.polyphone and seg_byte_len == 3 * len(seg):  # if pure east asian characters
+            seg_ = lazy_pinyin(seg, style=Style.TONE3, tone_sandhi=True)
+            for i, c in enumerate(seg):
+                if self.is_chinese(c):
                     char_list.append(" ")
-                char_list.extend(seg)
-            elif polyphone and seg_byte_len == 3 * len(seg):  # if pure east asian characters
-                seg_ = lazy_pinyin(seg, style=Style.TONE3, tone_sandhi=True)
-                for i, c in enumerate(seg):
-                    if is_chinese(c):
-                        char_list.append(" ")
-                    char_list.append(seg_[i])
-            else:  # if mixed characters, alphabets and symbols
-                for c in seg:
-                    if ord(c) < 256:
-                        char_list.extend(c)
-                    elif is_chinese(c):
+                char_list.append(seg_[i])
+        else:  # if mixed characters, alphabets and symbols
+            for c in seg:
+                if ord(c) < 256:
+                    char_list.extend(c)
+                elif self.is_chinese(c):
+                    char_list.append(" ")
+                    char_list.extend(lazy_pinyin(c, style=Style.TONE3, tone_sandhi=True))
+                else:
+                    char_list.append(c)
+        return tuple(char_list), False
+
+    def convert(self, text_list):
+        final_text_list = []
+        for text in text_list:
+            char_list = []
+            for block in jieba.re_han_default.split(text.translate(self.custom_trans)):
+                if not block:
+                    continue
+                for seg in self.cut(block):
+                    tokens, is_alphabet = self.convert_segment(seg)
+                    if is_alphabet and char_list and len(seg) > 1 and char_list[-1] not in " :'\"":
                         char_list.append(" ")
-                        char_list.extend(lazy_pinyin(c, style=Style.TONE3, tone_sandhi=True))
-                    else:
-                        char_list.append(c)
-        final_text_list.append(char_list)
+                    char_list.extend(tokens)
+            final_text_list.append(char_list)
+
+        return final_text_list
 
-    return final_text_list
+
+text_frontends = {}
+
+
+def get_text_frontend(polyphone=True):
+    # shared in process, by inference, evaluation and dataset preparation
+    if polyphone not in text_frontends:
+        text_frontends[polyphone] = TextFrontend(polyphone=polyphone)
+    return text_frontends[polyphone]
+
+
+def convert_char_to_pinyin(text_list, polyphone=True):
+    return get_text_frontend(polyphone).convert(text_list)
 
 
 # filter func for dirty data with many repetitions
@@ -1,22 +1,68 @@
-import socket
+import asyncio
+import json
+import queue
 import struct
+import threading
+import time
+
+import numpy as np
 import torch
-import torchaudio
-from threading import Thread
 
 
 import gc
 import traceback
 
 
-from infer.utils_infer import infer_batch_process, preprocess_ref_audio_text, load_vocoder, load_model
-from model.backbones.dit import DiT
+from f5_tts.infer.utils_infer import (
+    hop_length,
+    infer_batch_process,
+    infer_process_stream,
+    load_vocoder,
+    load_model,
+)
+from f5_tts.infer.scheduler import AdmissionRejected, Scheduler, estimate_cost
+from f5_tts.infer.voices import VoiceProfile, VoiceRegistry
+from f5_tts.model.backbones.dit import DiT
+from f5_tts.model.utils import CancellationToken, InferenceCancelled
+
+
+# Framing, all lengths big-endian:
+#   request:  length (uint32) + utf-8 json {"text", optional "voice", "nfe_step", "speed", "format": float32 | int16}
+#   response: frames of type (uint8) + length (uint32) + payload, for each request
+#             START json {"sample_rate", "format"}, AUDIO mono little-endian pcm ..., then END, or ERROR utf-8 message
+FRAME_START, FRAME_AUDIO, FRAME_END, FRAME_ERROR = range(4)
+frame_header = struct.Struct("!BI")
+request_header = struct.Struct("!I")
+sample_formats = {"float32": np.dtype("<f4"), "int16": np.dtype("<i2")}
+
+
+def to_pcm(audio, sample_format="float32"):
+    # float wave -> little-endian pcm array, int16 halves the bytes
+    if sample_format == "int16":
+        return (np.clip(audio, -1.0, 1.0) * 32767).astype(sample_formats["int16"])
+    return audio.astype(sample_formats["float32"], copy=False)
 
 
 class TTSStreamingProcessor:
-    def __init__(self, ckpt_file, vocab_file, ref_audio, ref_text, device=None, dtype=torch.float32):
+    def __init__(
+        self,
+        ckpt_file,
+        vocab_file,
+        ref_audio,
+        ref_text,
+        device=None,
+        dtype=torch.float32,
+        cfg_interval=None,
+        cfg_decay=None,
+        cfg_null_interval=1,
+        voices_dir=None,
+        voice=None,
+    ):
         self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
 
+        # Guidance schedule, trade some quality for fewer forwards per step
+        self.cfg_kwargs = dict(cfg_interval=cfg_interval, cfg_decay=cfg_decay, cfg_null_interval=cfg_null_interval)
+
         # Load the model using the provided checkpoint and vocab files
         self.model = load_model(
             model_cls=DiT,
@@ -35,9 +81,12 @@ class TTSStreamingProcessor:
         # Set sampling rate for streaming
         self.sampling_rate = 24000  # Consistency with client
 
-        # Set reference audio and text
-        self.ref_audio = ref_audio
-        self.ref_text = ref_text
+        # Preprocess reference audio and text once, or load it saved as voice in voices_dir
+        self.voices = VoiceRegistry(voices_dir) if voices_dir is not None else None  # also for voice per request
+        if voice is not None:
+            self.voice = self.voices.get(voice)
+        else:
+            self.voice = VoiceProfile.from_audio("ref", ref_audio, ref_text, device=self.device)
 
         # Warm up the model
         self._warm_up()
@@ -45,95 +94,334 @@ class TTSStreamingProcessor:
     def _warm_up(self):
         """Warm up the model with a dummy input to ensure it's ready for real-time processing."""
         print("Warming up the model...")
-        ref_audio, ref_text = preprocess_ref_audio_text(self.ref_audio, self.ref_text)
-        audio, sr = torchaudio.load(ref_audio)
         gen_text = "Warm-up text for the model."
 
         # Pass the vocoder as an argument here
-        infer_batch_process((audio, sr), ref_text, [gen_text], self.model, self.vocoder, device=self.device)
+        infer_batch_process(
+            self.voice, self.voice.ref_text, [gen_text], self.model, self.vocoder, device=self.device, **self.cfg_kwargs
+        )
         print("Warm-up completed.")
 
-    def generate_stream(self, text, play_steps_in_s=0.5):
-        """Generate audio in chunks and yield them in real-time."""
-        # Preprocess the reference audio and text
-        ref_audio, ref_text = preprocess_ref_audio_text(self.ref_audio, self.ref_text)
-
-        # Load reference audio
-        audio, sr = torchaudio.load(ref_audio)
+    def get_voice(self, voice=None):
+        if voice is None:
+            return self.voice
+        if self.voices is None:
+            raise ValueError("No voices_dir to choose voice from")
+        return self.voices.get(voice)
+
+    def estimate_cost(self, text, voice=None, nfe_step=32, speed=1.0, **kwargs):
+        """Estimated compute cost of generate_stream for the request, see scheduler.estimate_cost."""
+        profile = self.get_voice(voice)
+        return sum(
+            estimate_cost(profile, profile.ref_text, text, nfe_step=nfe_step, speed=speed, first_chunk_duration=2.0)
+        )
 
-        # Run inference for the input text
-        audio_chunk, final_sample_rate, _ = infer_batch_process(
-            (audio, sr),
-            ref_text,
-            [text],
+    def generate_stream(
+        self, text, play_steps_in_s=0.5, voice=None, nfe_step=32, speed=1.0, sample_format="float32", cancel_token=None
+    ):
+        """
+        Generate audio in chunks and yield them in real-time, as pcm arrays of sample_format.
+        Raises InferenceCancelled, also in the middle of sampling, once cancel_token is cancelled or past deadline.
+        """
+        # Break the generated audio into chunks and send them
+        chunk_size = int(self.sampling_rate * play_steps_in_s)
+        profile = self.get_voice(voice)
+
+        # Run inference for the input text, audio is available as soon as each vocoder window of play_steps_in_s is done
+        for audio_chunk in infer_process_stream(
+            profile,
+            profile.ref_text,
+            text,
             self.model,
             self.vocoder,
-            device=self.device,  # Pass vocoder here
+            vocoder_window_frames=max(chunk_size // hop_length, 1),
+            nfe_step=nfe_step,
+            speed=speed,
+            device=self.device,
+            cancel_token=cancel_token,
+            **self.cfg_kwargs,
+        ):
+            pcm = to_pcm(audio_chunk, sample_format)  # converted once, chunks are views of it
+            for i in range(0, len(pcm), chunk_size):
+                chunk = pcm[i : i + chunk_size]
+
+                # Send the chunk if it is not empty
+                if len(chunk) > 0:
+                    yield chunk
+
+
+class StreamRequest:
+    def __init__(self, params, loop, max_buffered_chunks, timeout=None, cost=0):
+        self.params = params  # generate_stream kwargs
+        self.cost = cost  # estimated, for the scheduler
+        self.compute_time = 0.0  # seconds the worker spent generating it
+        self.loop = loop
+        self.output = asyncio.Queue()  # audio chunks, then None at the end or the exception raised
+        self.credits = threading.Semaphore(max_buffered_chunks)  # chunks the worker may run ahead of the client
+        self.cancel_token = CancellationToken(timeout)  # cancelled on disconnect, or past deadline
+        self.stream = None
+
+    def put(self, item):
+        # from worker thread
+        self.loop.call_soon_threadsafe(self.output.put_nowait, item)
+
+
+class ClientReader:
+    """
+    Reader of a connection, also watched while a request streams to tell a client gone (closed, or half-closed) at
+    once, rather than on a later failed write. Bytes a client sends ahead meanwhile are kept for the next request.
+    """
+
+    def __init__(self, reader, max_read_ahead):
+        self.reader = reader
+        self.buffer = bytearray()
+        self.max_read_ahead = max_read_ahead
+
+    async def readexactly(self, n):
+        if len(self.buffer) < n:
+            self.buffer += await self.reader.readexactly(n - len(self.buffer))
+        data = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        return data
+
+    async def watch(self, on_disconnect):
+        # run until cancelled, on_disconnect() called once the connection ends
+        try:
+            while len(self.buffer) <= self.max_read_ahead:
+                data = await self.reader.read(1 << 16)
+                if not data:
+                    break
+                self.buffer += data
+            else:
+                return  # client sent too much ahead, handle_client turns it away later
+        except ConnectionError:
+            pass
+        on_disconnect()
+
+
+class TTSServer:
+    """
+    Asyncio server, one inference worker thread for all connections: it interleaves up to max_concurrency streams
+    chunk by chunk, so no request waits for another to finish, while the model only ever runs one at a time.
+    A stream is only advanced while its client keeps up (max_buffered_chunks ahead at most), more requests wait in a
+    queue of max_queue, beyond that they are turned away. Queued requests start shortest (estimated cost) first with
+    aging, see Scheduler, those over max_request_cost or max_queue_cost of queued work are turned away too.
+    A client disconnecting cancels its request as soon as the connection ends, waiting, queued or in the middle of
+    sampling a chunk, and so does a request running past request_timeout seconds (queueing included).
+    """
+
+    def __init__(
+        self,
+        processor,
+        max_concurrency=4,
+        max_queue=64,
+        max_buffered_chunks=4,
+        queue_timeout=10.0,
+        max_request_bytes=1 << 20,
+        max_nfe_step=64,
+        request_timeout=None,
+        max_request_cost=None,
+        max_queue_cost=None,
+        aging=10.0,
+    ):
+        self.processor = processor
+        self.max_concurrency = max_concurrency
+        self.max_buffered_chunks = max_buffered_chunks
+        self.queue_timeout = queue_timeout  # seconds to wait for a place in queue before turning a request away
+        self.requests = Scheduler(max_request_cost, max_queue_cost, aging)
+        self.slots = None  # asyncio.Semaphore(max_concurrency + max_queue), made in serve() on its loop
+        self.max_queue = max_queue
+        self.max_request_bytes = max_request_bytes
+        self.max_nfe_step = max_nfe_step
+        self.request_timeout = request_timeout
+        self.worker = threading.Thread(target=self.work, daemon=True)
+
+    def work(self):
+        active = []
+        stopping = False
+        while not stopping or active:
+            # take new requests while there is room, wait for one if idle
+            while not stopping and len(active) < self.max_concurrency:
+                try:
+                    request = self.requests.get(block=not active)
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                elif request.cancel_token.cancelled:
+                    request.put(InferenceCancelled(request.cancel_token.reason))
+                    self.requests.done(request.cost)
+                else:
+                    request.stream = self.processor.generate_stream(**request.params, cancel_token=request.cancel_token)
+                    active.append(request)
+
+            advanced = False
+            for request in list(active):
+                if request.cancel_token.cancelled:
+                    request.stream.close()  # frees what it holds on device
+                    request.put(InferenceCancelled(request.cancel_token.reason))  # unread if client gone
+                    active.remove(request)
+                    self.requests.done(request.cost)
+                    continue
+                if not request.credits.acquire(blocking=False):
+                    continue  # client behind, serve others meanwhile
+                start = time.perf_counter()
+                try:
+                    request.put(next(request.stream))
+                    advanced = True
+                    request.compute_time += time.perf_counter() - start
+                except StopIteration:
+                    request.put(None)
+                    active.remove(request)
+                    self.requests.done(request.cost, request.compute_time)  # learn seconds per cost
+                except InferenceCancelled as e:  # cancelled while sampling
+                    request.put(e)
+                    active.remove(request)
+                    self.requests.done(request.cost)
+                except Exception as e:
+                    traceback.print_exc()
+                    request.put(e)
+                    active.remove(request)
+                    self.requests.done(request.cost)
+
+            if active and not advanced:
+                time.sleep(0.005)  # all clients behind
+
+    @staticmethod
+    def send_frame(writer, frame_type, payload=b""):
+        writer.write(frame_header.pack(frame_type, len(payload)))
+        if len(payload) > 0:
+            writer.write(payload)  # bytes or memoryview of a pcm array, not copied if the socket takes it at once
+
+    def parse_request(self, payload):
+        request = json.loads(payload.decode("utf-8"))
+        if not isinstance(request, dict) or not isinstance(request.get("text"), str) or not request["text"].strip():
+            raise ValueError("request needs text")
+        sample_format = request.get("format", "float32")
+        if sample_format not in sample_formats:
+            raise ValueError(f"format should be one of {list(sample_formats)}")
+        nfe_step, speed = int(request.get("nfe_step", 32)), float(request.get("speed", 1.0))
+        if not 1 <= nfe_step <= self.max_nfe_step or not 0.25 <= speed <= 4.0:
+            raise ValueError(f"nfe_step should be in [1, {self.max_nfe_step}], speed in [0.25, 4]")
+        voice = request.get("voice")
+        if voice is not None and not isinstance(voice, str):
+            raise ValueError("voice should be a name")
+        return dict(
+            text=request["text"].strip(),
+            voice=voice,
+            nfe_step=nfe_step,
+            speed=speed,
+            sample_format=sample_format,
         )
 
-        # Break the generated audio into chunks and send them
-        chunk_size = int(final_sample_rate * play_steps_in_s)
-
-        if len(audio_chunk) < chunk_size:
-            packed_audio = struct.pack(f"{len(audio_chunk)}f", *audio_chunk)
-            yield packed_audio
+    async def stream(self, params, reader, writer):
+        # turn away too costly requests at once, queued ones only after a slot is taken
+        loop = asyncio.get_running_loop()
+        try:
+            # off the event loop, a voice used for the first time is loaded from disk
+            cost = await loop.run_in_executor(None, lambda: self.processor.estimate_cost(**params))
+            self.requests.admit(cost)
+        except (AdmissionRejected, KeyError, ValueError) as e:  # also unknown or invalid voice
+            self.send_frame(writer, FRAME_ERROR, str(e).encode("utf-8"))
             return
-
-        for i in range(0, len(audio_chunk), chunk_size):
-            chunk = audio_chunk[i : i + chunk_size]
-
-            # Check if it's the final chunk
-            if i + chunk_size >= len(audio_chunk):
-                chunk = audio_chunk[i:]
-
-            # Send the chunk if it is not empty
-            if len(chunk) > 0:
-                packed_audio = struct.pack(f"{len(chunk)}f", *chunk)
-                yield packed_audio
-
-
-def handle_client(client_socket, processor):
-    try:
-        while True:
-            # Receive data from the client
-            data = client_socket.recv(1024).decode("utf-8")
-            if not data:
-                break
-
+        request = StreamRequest(params, loop, self.max_buffered_chunks, self.request_timeout, cost=cost)
+        # a client gone cancels its request, waiting for a slot, queued or sampling, without waiting for a write to fail
+        watcher = asyncio.create_task(reader.watch(lambda: request.cancel_token.cancel("client disconnected")))
+        acquired = False
+        try:
+            acquire = asyncio.ensure_future(self.slots.acquire())
+            await asyncio.wait([acquire, watcher], timeout=self.queue_timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not acquire.done():
+                acquire.cancel()
+                await asyncio.wait([acquire])
+            acquired = not acquire.cancelled()
+            if not acquired:
+                if not request.cancel_token.cancelled:
+                    print(f"Server busy, request turned away: {params['text'][:50]}")
+                    self.send_frame(writer, FRAME_ERROR, b"server busy")
+                return
+            if request.cancel_token.cancelled:
+                return
+
+            def drop(reason):
+                # cancelled while queued, leaves the queue (and its budget) at once rather than once the worker gets to it
+                if self.requests.cancel([request]):
+                    request.put(InferenceCancelled(reason))
+
+            request.cancel_token.add_callback(drop)
             try:
-                # The client sends the text input
-                text = data.strip()
-
-                # Generate and stream audio chunks
-                for audio_chunk in processor.generate_stream(text):
-                    client_socket.sendall(audio_chunk)
-
-                # Send end-of-audio signal
-                client_socket.sendall(b"END_OF_AUDIO")
-
-            except Exception as inner_e:
-                print(f"Error during processing: {inner_e}")
-                traceback.print_exc()  # Print the full traceback to diagnose the issue
-                break
-
-    except Exception as e:
-        print(f"Error handling client: {e}")
-        traceback.print_exc()
-    finally:
-        client_socket.close()
-
-
-def start_server(host, port, processor):
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.bind((host, port))
-    server.listen(5)
-    print(f"Server listening on {host}:{port}")
-
-    while True:
-        client_socket, addr = server.accept()
+                wait = self.requests.put([request], [cost], request.cancel_token)
+            except AdmissionRejected as e:
+                print(f"{e}, request turned away: {params['text'][:50]}")
+                self.send_frame(writer, FRAME_ERROR, str(e).encode("utf-8"))
+                return
+            start = dict(sample_rate=self.processor.sampling_rate, format=params["sample_format"], wait=wait)
+            self.send_frame(writer, FRAME_START, json.dumps(start).encode("utf-8"))
+            while True:
+                chunk = await request.output.get()
+                if chunk is None:
+                    break
+                if isinstance(chunk, Exception):
+                    self.send_frame(writer, FRAME_ERROR, str(chunk).encode("utf-8"))
+                    return
+                self.send_frame(writer, FRAME_AUDIO, memoryview(chunk).cast("B"))
+                await writer.drain()  # waits if client reads slowly
+                request.credits.release()
+            self.send_frame(writer, FRAME_END)
+        finally:
+            request.cancel_token.cancel()  # no-op if done, else the worker drops the stream, or stops sampling it
+            if acquired:
+                self.slots.release()
+            watcher.cancel()
+            await asyncio.wait([watcher])  # reader free for the next request
+
+    async def handle_client(self, reader, writer):
+        addr = writer.get_extra_info("peername")
         print(f"Accepted connection from {addr}")
-        client_handler = Thread(target=handle_client, args=(client_socket, processor))
-        client_handler.start()
+        reader = ClientReader(reader, request_header.size + self.max_request_bytes)
+        try:
+            while True:
+                # Receive a request from the client, connection closed between requests ends it
+                try:
+                    (length,) = request_header.unpack(await reader.readexactly(request_header.size))
+                except asyncio.IncompleteReadError:
+                    break
+                if length > self.max_request_bytes:
+                    self.send_frame(writer, FRAME_ERROR, b"request too large")
+                    break
+                payload = await reader.readexactly(length)
+
+                try:
+                    params = self.parse_request(payload)
+                except (ValueError, TypeError) as e:  # also json and unicode decode errors
+                    self.send_frame(writer, FRAME_ERROR, f"bad request: {e}".encode("utf-8"))
+                else:
+                    # Generate and stream audio chunks
+                    await self.stream(params, reader, writer)
+                await writer.drain()
+
+        except (ConnectionError, asyncio.IncompleteReadError):
+            print(f"Connection from {addr} lost")
+        except Exception as e:
+            print(f"Error handling client: {e}")
+            traceback.print_exc()
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        self.slots = asyncio.Semaphore(self.max_concurrency + self.max_queue)
+        self.worker.start()
+        server = await asyncio.start_server(self.handle_client, host, port)
+        print(f"Server listening on {host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.requests.close()
+
+
+def start_server(host, port, processor, **kwargs):
+    asyncio.run(TTSServer(processor, **kwargs).serve(host, port))
 
 
 if __name__ == "__main__":
@@ -153,7 +441,7 @@ if __name__ == "__main__":
             dtype=torch.float32,
         )
 
-        # Start the server
-        start_server("0.0.0.0", 9998, processor)
+        # Start the server, one inference worker for all clients
+        start_server("0.0.0.0", 9998, processor, max_concurrency=4, max_queue=64)
     except KeyboardInterrupt:
         gc.collect()
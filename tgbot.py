@@ -1,11 +1,13 @@
 import os
-import subprocess
+import threading
 import telebot
 import logging
 from datetime import datetime
 from dotenv import load_dotenv
 from concurrent.futures import ThreadPoolExecutor
 
+from f5_tts.api import F5TTS
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -25,21 +27,76 @@ TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 bot = telebot.TeleBot(TOKEN)
 
 # Initialize thread pool
-executor = ThreadPoolExecutor(max_workers=3)  # Limit concurrent generations
+executor = ThreadPoolExecutor(max_workers=3)  # Limit concurrent requests
 
 # Cache for recently generated audio
 audio_cache = {}
 MAX_CACHE_SIZE = 100  # Maximum number of cached items
 
-def generate_audio(text):
-    """Separate function for audio generation to be run in thread"""
-    result = subprocess.run(
-        ['./tts_gen.sh', text],
-        capture_output=True,
-        text=True,
-        check=True
-    )
-    return result.stdout.strip().split('\n')[-1]
+# Pre-transcribed reference audio, preprocessed once into ./voices on first run
+REF_AUDIO = 'sucai_dm.wav'
+REF_TEXT = '你愿意全部交给姐姐吗不愿意啊那你可别忘了我手机里的照片'
+VOICES_DIR = './voices'
+VOICE = 'sucai_dm'
+OUTPUT_DIR = './output_audio'
+
+# Load model, vocoder and voice once, kept for the lifetime of the bot
+logger.info("Loading TTS model...")
+tts = F5TTS(model_type='F5-TTS', voices_dir=VOICES_DIR)
+if VOICE not in tts.voices:
+    tts.add_voice(VOICE, REF_AUDIO, REF_TEXT)
+voice = tts.voices.get(VOICE)
+os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+# Single inference worker, requests wait their turn in its queue
+tts_executor = ThreadPoolExecutor(max_workers=1)
+status_executor = ThreadPoolExecutor(max_workers=1)  # Status edits in order, not holding up inference
+pending_count = 0  # Requests queued or generating
+pending_lock = threading.Lock()
+
+def edit_status(chat_id, message_id, text):
+    """Edit status message, failures (e.g. rate limit) only logged"""
+    try:
+        bot.edit_message_text(text, chat_id, message_id)
+    except Exception as e:
+        logger.warning(f"Failed to update status: {e}")
+
+class StatusProgress:
+    """Progress for inference, edits status message as each text chunk starts generating"""
+    def __init__(self, chat_id, message_id):
+        self.chat_id = chat_id
+        self.message_id = message_id
+
+    def tqdm(self, iterable):
+        chunks = list(iterable)
+        for i, chunk in enumerate(chunks):
+            status_executor.submit(
+                edit_status,
+                self.chat_id,
+                self.message_id,
+                f"🎯 Processing:\n⌛ Generating audio... ({i + 1}/{len(chunks)})"
+            )
+            yield chunk
+
+def generate_audio(text, progress):
+    """Generate audio with the loaded model, run one at a time in tts_executor"""
+    global pending_count
+    try:
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        output_file = os.path.join(OUTPUT_DIR, f'tts_{timestamp}.wav')
+        tts.infer(None, None, text, show_info=logger.info, progress=progress, file_wave=output_file, voice=voice)
+        return output_file
+    finally:
+        with pending_lock:
+            pending_count -= 1
+
+def submit_audio(text, progress):
+    """Queue audio generation, returns future of output file and number of requests ahead"""
+    global pending_count
+    with pending_lock:
+        ahead = pending_count
+        pending_count += 1
+    return tts_executor.submit(generate_audio, text, progress), ahead
 
 @bot.message_handler(commands=['start'])
 def send_welcome(message):
@@ -71,18 +128,22 @@ def generate_tts(message):
         return
 
     processing_msg = bot.reply_to(message, "⌛ Queued for processing...")
+
+    # Queue for the inference worker, status updated with place in queue and progress
+    progress = StatusProgress(message.chat.id, processing_msg.message_id)
+    future, ahead = submit_audio(text, progress)
+    if ahead > 0:
+        status_executor.submit(
+            edit_status,
+            message.chat.id,
+            processing_msg.message_id,
+            f"⌛ Queued for processing ({ahead} ahead)..."
+        )
     
     def process_audio():
         try:
-            # Update status
-            bot.edit_message_text(
-                "🎯 Processing:\n⌛ Generating audio...",
-                message.chat.id,
-                processing_msg.message_id
-            )
-            
-            # Generate audio in thread
-            output_file = generate_audio(text)
+            # Wait for audio generation
+            output_file = future.result()
             
             # Cache the result
             if len(audio_cache) >= MAX_CACHE_SIZE:
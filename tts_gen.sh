@@ -21,15 +21,19 @@ find "$TEMP_DIR" -type f -mmin +60 -delete
 timestamp=$(date +"%Y%m%d_%H%M%S")
 output_file="$TEMP_DIR/tts_${timestamp}.wav"
 
-# Use pre-transcribed reference audio
+# Use pre-transcribed reference audio, preprocessed once into ./voices on first run
 REF_AUDIO="sucai_dm.wav"
 REF_TEXT="你愿意全部交给姐姐吗不愿意啊那你可别忘了我手机里的照片"
+VOICES_DIR="./voices"
+VOICE="sucai_dm"
 
 # Run F5 TTS command with optimized settings
 CUDA_VISIBLE_DEVICES=0 f5-tts_infer-cli \
     --model "F5-TTS" \
     --ref_audio "$REF_AUDIO" \
     --ref_text "$REF_TEXT" \
+    --voices_dir "$VOICES_DIR" \
+    --voice "$VOICE" \
     --gen_text "$1" \
     --output_file "$output_file"
 